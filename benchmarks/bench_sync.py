@@ -0,0 +1,31 @@
+#
+# Measures the per-call overhead of the blocking facade (libhttpcam.synccam)
+# against building a new event loop per call with asyncio.run().
+#
+#   python benchmarks/bench_sync.py [calls]
+#
+
+import asyncio
+import sys
+import time
+from libhttpcam.synccam import LoopThread
+
+
+async def noop():
+    return None
+
+
+def measure(name, fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    elapsed = time.perf_counter() - start
+    print('%-12s %6d calls: %7.3fs  %7.1f us/call' % (name, calls, elapsed, elapsed / calls * 1e6))
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    loop = LoopThread()
+    measure('asyncio.run', lambda: asyncio.run(noop()), calls)
+    measure('LoopThread', lambda: loop.run(noop()), calls)
+    loop.stop()
@@ -0,0 +1,67 @@
+#
+# Compares the aiohttp transport with libhttpcam.leanhttp.LeanSession for
+# small CGI requests against a local emulated Foscam CGI server.
+#
+#   python benchmarks/bench_transport.py [requests] [cameras]
+#
+
+import asyncio
+import sys
+import time
+import aiohttp
+from libhttpcam.foscam import Foscam
+from libhttpcam.leanhttp import LeanSession
+
+REPLY = (b'<CGI_Result>\n    <result>0</result>\n    <ftpAddr>ftp://10.0.0.2/</ftpAddr>\n'
+         b'    <ftpPort>21</ftpPort>\n    <mode>0</mode>\n    <userName>cam</userName>\n</CGI_Result>')
+
+_handlers = set()
+
+
+async def handle(reader, writer):
+    _handlers.add(asyncio.current_task())
+    try:
+        while True:
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n\r\n%s'
+                         % (len(REPLY), REPLY))
+            await writer.drain()
+    finally:
+        writer.close()
+        _handlers.discard(asyncio.current_task())
+
+
+async def run(name, session, port, requests, cameras):
+    cams = [Foscam('127.0.0.1', port, session) for _ in range(cameras)]
+    per_cam = requests // cameras
+
+    async def poll(cam):
+        for _ in range(per_cam):
+            await cam.async_get_ftp_config()
+
+    await poll(cams[0])     # warm up the connection pool
+    start = time.perf_counter()
+    await asyncio.gather(*[poll(cam) for cam in cams])
+    elapsed = time.perf_counter() - start
+    await session.close()
+    print('%-8s %6d requests: %7.3fs  %7.1f us/request' % (name, per_cam * cameras, elapsed, elapsed / (per_cam * cameras) * 1e6))
+
+
+async def main(requests, cameras):
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    await run('aiohttp', aiohttp.ClientSession(), port, requests, cameras)
+    await run('lean', LeanSession(), port, requests, cameras)
+    server.close()
+    await server.wait_closed()
+    # the sessions closed their connections; let the handlers see the EOF and finish
+    await asyncio.wait(list(_handlers), timeout=1) if _handlers else None
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cameras = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(requests, cameras))
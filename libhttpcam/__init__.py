@@ -1 +1,10 @@
-from .httpcam import HttpCam, createCam, HttpCamError, Trigger, Action, Status, IRmode
+from .httpcam import HttpCam, createCam, HttpCamError, Trigger, Action, Status, IRmode, Profile
+from .leanhttp import LeanSession
+from .synccam import SyncCam, SyncFleet
+from .shard import ShardedFleet
+from .prebuffer import FrameRing, PreEventBuffer
+from .recorder import MjpegRecorder, RecordingReader
+from .fleetstate import FleetState
+from .receiver import UploadReceiver, Upload
+from .bufferpool import BufferPool, PooledBuffer
+from .timelapse import Timelapse, TimelapseReader
@@ -0,0 +1,226 @@
+#
+# Change-only snapshot archiving.
+#
+# Periodic snapshots of a static scene are nearly identical. SnapshotArchiver
+# computes a 64-bit perceptual hash (DCT hash of a 32x32 grayscale reduction)
+# for each snapshot and stores it only if its Hamming distance to the camera's
+# last stored snapshot exceeds a threshold. Hashes are computed in NumPy batches
+# across cameras and kept in a compact HashIndex for duplicate lookup.
+#
+# Requires the optional packages numpy and Pillow (`pip install libhttpcam[archive]`).
+#
+
+import asyncio
+import io
+import os
+import threading
+import time
+import logging
+from libhttpcam.httpcam import HttpCamError, RESULT_CODE
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:     # pragma: no cover
+    np = None
+    Image = None
+
+_LOGGER = logging.getLogger(__name__)
+
+HASH_SIZE = 8           # hash is HASH_SIZE x HASH_SIZE bits
+REDUCED_SIZE = 32       # images are reduced to REDUCED_SIZE x REDUCED_SIZE before the DCT
+THRESHOLD = 6           # max Hamming distance of a 'same scene' snapshot
+BATCH_SIZE = 64
+
+_dct_matrix = None
+
+
+def _require():
+    if np is None or Image is None:
+        raise HttpCamError('snapshot archiving requires numpy and Pillow')
+
+
+def _dct():
+    ''' orthonormal DCT-II matrix of size REDUCED_SIZE '''
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = REDUCED_SIZE
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+        m[0] /= np.sqrt(2.0)
+        _dct_matrix = m.astype(np.float32)
+    return _dct_matrix
+
+
+def reduce_image(jpeg: bytes):
+    ''' decodes a JPEG into a REDUCED_SIZE x REDUCED_SIZE grayscale float32 array '''
+    _require()
+    img = Image.open(io.BytesIO(jpeg))
+    # let the JPEG decoder downscale via the DCT, far cheaper than a full decode
+    img.draft('L', (REDUCED_SIZE * 4, REDUCED_SIZE * 4))
+    img = img.convert('L').resize((REDUCED_SIZE, REDUCED_SIZE), Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+
+def phash_batch(images) -> 'np.ndarray':
+    '''
+    computes the perceptual hashes of a (N, REDUCED_SIZE, REDUCED_SIZE) stack
+    of grayscale images; returns N uint64 hashes.
+    '''
+    _require()
+    d = _dct()
+    coeffs = d @ np.asarray(images, dtype=np.float32) @ d.T
+    low = coeffs[:, :HASH_SIZE, :HASH_SIZE].reshape(len(coeffs), -1)
+    # the median excludes the DC term, which only carries the mean brightness
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    bits = np.packbits(low > median, axis=1)
+    return bits.view('>u8').ravel().astype(np.uint64)
+
+
+def hamming(a, b) -> 'np.ndarray':
+    ''' elementwise Hamming distances between uint64 hash arrays (broadcasting) '''
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    bits = np.unpackbits(x.reshape(-1).view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1).reshape(x.shape)
+
+
+class HashIndex():
+    """ compact index of the stored snapshot hashes: uint64 hash, camera number and time per entry """
+
+    def __init__(self, capacity=1024):
+        _require()
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._cams = np.zeros(capacity, dtype=np.uint32)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._count = 0
+        self._names = []
+        self._numbers = {}
+
+    def __len__(self):
+        return self._count
+
+    def _number(self, cam_id) -> int:
+        number = self._numbers.get(cam_id)
+        if number is None:
+            number = self._numbers[cam_id] = len(self._names)
+            self._names.append(cam_id)
+        return number
+
+    def add(self, cam_id, phash, stamp):
+        if self._count == len(self._hashes):
+            size = 2 * len(self._hashes)
+            self._hashes = np.resize(self._hashes, size)
+            self._cams = np.resize(self._cams, size)
+            self._times = np.resize(self._times, size)
+        self._hashes[self._count] = phash
+        self._cams[self._count] = self._number(cam_id)
+        self._times[self._count] = stamp
+        self._count += 1
+
+    def lookup(self, phash, threshold=THRESHOLD, cam_id=None) -> list:
+        '''
+        returns [(cam_id, time, distance)] of the stored snapshots within `threshold`
+        of `phash`, optionally restricted to one camera.
+        '''
+        dist = hamming(self._hashes[:self._count], phash)
+        mask = dist <= threshold
+        if cam_id is not None:
+            mask &= self._cams[:self._count] == self._numbers.get(cam_id, -1)
+        return [(self._names[self._cams[i]], float(self._times[i]), int(dist[i])) for i in np.nonzero(mask)[0]]
+
+    def save(self, path):
+        np.savez(path, hashes=self._hashes[:self._count], cams=self._cams[:self._count],
+                 times=self._times[:self._count], names=np.array([str(n) for n in self._names]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        index = cls(max(len(data['hashes']), 1))
+        n = len(data['hashes'])
+        index._hashes[:n] = data['hashes']
+        index._cams[:n] = data['cams']
+        index._times[:n] = data['times']
+        index._count = n
+        index._names = list(data['names'])
+        index._numbers = {name: i for i, name in enumerate(index._names)}
+        return index
+
+
+class SnapshotArchiver():
+    """
+    Stores snapshots only when the scene changed.
+
+        archiver = SnapshotArchiver('/media/archive')
+        stored = await archiver.capture({'porch': cam1, 'garage': cam2})
+    """
+
+    def __init__(self, directory, threshold=THRESHOLD, batch_size=BATCH_SIZE, index=None):
+        _require()
+        self._directory = directory
+        self._threshold = threshold
+        self._batch_size = batch_size
+        self._index = HashIndex() if index is None else index
+        self._last = {}         # cam_id -> hash of the last stored snapshot
+        self._pending = []      # [(cam_id, stamp, jpeg)]
+        self._lock = threading.Lock()   # serializes the executor threads running _archive
+
+    @property
+    def index(self) -> HashIndex:
+        return self._index
+
+    async def capture(self, cams: dict) -> list:
+        ''' snaps all cameras concurrently and archives the results in one batch '''
+        ids = list(cams)
+        results = await asyncio.gather(*[cams[i].async_snap_picture() for i in ids], return_exceptions=True)
+        stamp = time.time()
+        for cam_id, result in zip(ids, results):
+            if isinstance(result, Exception):
+                _LOGGER.warning('archive snapshot %s: %s', cam_id, result)
+            elif result[0] == RESULT_CODE['0'] and isinstance(result[1], (bytes, bytearray)):
+                self._pending.append((cam_id, stamp, result[1]))
+        return await self.flush()
+
+    async def submit(self, cam_id, jpeg, stamp) -> list:
+        ''' queues a snapshot; archives the queue once `batch_size` snapshots are pending '''
+        self._pending.append((cam_id, stamp, jpeg))
+        if len(self._pending) >= self._batch_size:
+            return await self.flush()
+        return []
+
+    async def flush(self) -> list:
+        ''' hashes the pending snapshots and stores the changed ones; returns their file paths '''
+        pending, self._pending = self._pending, []
+        if not pending:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(None, self._archive, pending)
+
+    def _archive(self, pending) -> list:
+        with self._lock:
+            return self._archive_locked(pending)
+
+    def _archive_locked(self, pending) -> list:
+        images, kept = [], []
+        for item in pending:
+            try:
+                images.append(reduce_image(item[2]))
+                kept.append(item)
+            except Exception as e:
+                _LOGGER.warning('archive: cannot decode snapshot of %s: %s', item[0], e)
+        if not kept:
+            return []
+        hashes = phash_batch(np.stack(images))
+        stored = []
+        for (cam_id, stamp, jpeg), phash in zip(kept, hashes):
+            last = self._last.get(cam_id)
+            if last is not None and int(hamming(last, phash)) <= self._threshold:
+                continue
+            folder = os.path.join(self._directory, str(cam_id))
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, '%d.jpg' % (stamp * 1000))
+            with open(path, 'wb') as f:
+                f.write(jpeg)
+            self._last[cam_id] = phash
+            self._index.add(cam_id, phash, stamp)
+            stored.append(path)
+        return stored
@@ -0,0 +1,154 @@
+#
+# Reusable buffers for snapshot and frame bodies.
+#
+# Reading every snapshot or MJPEG frame into a fresh multi-MB bytes object
+# churns the allocator. A BufferPool hands out bytearrays from power-of-two
+# size classes; a body is copied into a pooled buffer as it arrives, and the
+# caller gets a PooledBuffer exposing a memoryview of the body. Releasing the
+# PooledBuffer returns the bytearray to its class for reuse.
+#
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+MIN_CLASS = 16 * 1024               # smallest buffer size
+MAX_PER_CLASS = 8                   # idle buffers kept per size class
+DEFAULT_HINT = 256 * 1024           # first allocation for an unknown body size
+
+
+def size_class(size) -> int:
+    ''' the smallest power-of-two buffer size, at least MIN_CLASS, holding `size` bytes '''
+    n = MIN_CLASS
+    while n < size:
+        n <<= 1
+    return n
+
+
+class PooledBuffer():
+    """ a body held in a pooled bytearray; call `release()` when done with it """
+
+    __slots__ = ('_pool', '_buf', '_len', '_view')
+
+    def __init__(self, pool, buf):
+        self._pool = pool
+        self._buf = buf
+        self._len = 0
+        self._view = None
+
+    @property
+    def view(self) -> memoryview:
+        ''' the body; invalid after release() '''
+        if self._view is None:
+            self._view = memoryview(self._buf)[:self._len]
+        return self._view
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf)
+
+    def write(self, data):
+        ''' appends data, moving to a larger pooled buffer if needed '''
+        if self._pool is None:
+            raise TypeError('wrapped PooledBuffer is read-only')
+        end = self._len + len(data)
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if end > len(self._buf):
+            bigger = self._pool._take(end)
+            bigger[:self._len] = self._buf[:self._len]
+            self._pool._give(self._buf)
+            self._buf = bigger
+        self._buf[self._len:end] = data
+        self._len = end
+
+    def tobytes(self) -> bytes:
+        return bytes(self.view)
+
+    def release(self):
+        if self._buf is not None:
+            if self._view is not None:
+                self._view.release()
+                self._view = None
+            if self._pool is not None:
+                self._pool._give(self._buf)
+            self._buf = None
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, key):
+        return self.view[key]
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class BufferPool():
+    """ size-classed pool of bytearrays with hit-rate statistics """
+
+    def __init__(self, max_per_class=MAX_PER_CLASS):
+        self._max_per_class = max_per_class
+        self._free = {}         # size class -> [bytearray]
+        self._observed = {}     # key -> last observed body size
+        self._hits = 0
+        self._misses = 0
+
+    def acquire(self, size=None, key=None) -> PooledBuffer:
+        '''
+        returns an empty PooledBuffer able to hold `size` bytes without growing.
+        Without `size`, the last size observed for `key` is used.
+        '''
+        if size is None:
+            size = self._observed.get(key, DEFAULT_HINT)
+        return PooledBuffer(self, self._take(size))
+
+    def copy(self, data) -> PooledBuffer:
+        ''' returns a PooledBuffer holding a copy of `data` '''
+        buf = self.acquire(len(data))
+        buf.write(data)
+        return buf
+
+    def wrap(self, body) -> PooledBuffer:
+        '''
+        returns a read-only PooledBuffer holding `body` itself, for bodies that
+        already were read into memory; releasing it does not return anything to the pool
+        '''
+        buf = PooledBuffer(None, body)
+        buf._len = len(body)
+        return buf
+
+    def observe(self, key, size):
+        ''' records the body size seen for `key`, used to size the next buffer for it '''
+        self._observed[key] = size
+
+    def _take(self, size) -> bytearray:
+        cls = size_class(size)
+        free = self._free.get(cls)
+        if free:
+            self._hits += 1
+            return free.pop()
+        self._misses += 1
+        return bytearray(cls)
+
+    def _give(self, buf):
+        free = self._free.setdefault(len(buf), [])
+        if len(free) < self._max_per_class:
+            free.append(buf)
+
+    def stats(self) -> dict:
+        ''' hits, misses, hit_rate, and idle buffers per size class '''
+        total = self._hits + self._misses
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / total if total else 0.0,
+            'idle': {cls: len(free) for cls, free in sorted(self._free.items())},
+        }
@@ -0,0 +1,86 @@
+#
+# Concurrent execution of multi-command operations.
+#
+# Cameras without a batch interface need several CGI requests for one operation.
+# A CommandPlan declares the commands of one or more operations and the commands
+# each of them depends on. `run` sends each command as soon as its dependencies
+# succeeded, so independent commands are in flight together, bounded by the
+# camera host's request scheduler, and merges the results into one Response.
+#
+#   plan = cam.alarm_plan(trigger, action)
+#   plan.extend(cam.system_time_plan())
+#   code, result = await cam.async_run_plan(plan)
+#
+
+import asyncio
+import logging
+from libhttpcam.httpcam import RESULT_CODE, Response
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CommandPlan():
+    """ commands of an operation with their dependencies """
+
+    def __init__(self):
+        self._steps = {}    # name -> (cmd, params, names of the steps it depends on, optional)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __iter__(self):
+        return iter(self._steps)
+
+    def add(self, cmd, params=None, after=(), name=None, optional=False) -> str:
+        '''
+        adds a command, sent only after the steps named in `after` succeeded.
+        `name` identifies the step and defaults to `cmd`. The failure of an
+        `optional` step is logged but does not fail the plan. Returns the step's name.
+        '''
+        name = cmd if name is None else name
+        if name in self._steps:
+            raise ValueError('duplicate plan step %s' % name)
+        for dep in after:
+            if dep not in self._steps:
+                raise ValueError('plan step %s depends on unknown step %s' % (name, dep))
+        self._steps[name] = (cmd, params or [], tuple(after), optional)
+        return name
+
+    def extend(self, other: 'CommandPlan') -> 'CommandPlan':
+        ''' adds the steps of another plan, e.g. to run several operations in one pass '''
+        for name, (cmd, params, after, optional) in other._steps.items():
+            self.add(cmd, params, after, name, optional)
+        return self
+
+    async def run(self, cam) -> Response:
+        '''
+        sends the commands to `cam`, each as soon as its dependencies succeeded.
+        Returns the first failed non-optional step's Response in declaration order,
+        otherwise a success code with the dictionary results of the successful steps merged.
+        '''
+        tasks = {}
+
+        async def step(name, cmd, params, after):
+            for dep in after:
+                code, result = await tasks[dep]
+                if code != RESULT_CODE['0']:
+                    _LOGGER.debug('%s: skipping %s, %s failed', cam.host, name, dep)
+                    return (code, result)
+            return await cam._async_fetch(cmd, params)
+
+        for name, (cmd, params, after, _) in self._steps.items():
+            tasks[name] = asyncio.ensure_future(step(name, cmd, params, after))
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        merged = {}
+        for (name, (_, _, _, optional)), (code, result) in zip(self._steps.items(), results):
+            if code != RESULT_CODE['0']:
+                if optional:
+                    _LOGGER.info('%s: optional %s failed: %s', cam.host, name, code)
+                    continue
+                return (code, result)
+            if isinstance(result, dict):
+                merged.update(result)
+        return (RESULT_CODE['0'], merged)
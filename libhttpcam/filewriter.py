@@ -0,0 +1,104 @@
+#
+# Background file writing for the recorders.
+#
+# A FileWriter owns one thread fed by a bounded queue. `put` is called from the
+# event loop and drops the item when the queue is full, so a slow disk costs
+# frames rather than stalling the loop. The thread hands each item to a `write`
+# callback that appends it to one of its open files, and flushes all open files
+# at least every FLUSH_SECONDS so readers see recent data.
+#
+
+import asyncio
+import queue
+import threading
+import time
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1024               # items waiting for the writer thread
+WRITE_BUFFER = 1024 * 1024      # bytes buffered per open data file
+FLUSH_SECONDS = 1.0             # max delay before buffered data becomes visible to readers
+
+
+class DataIndexFiles():
+    """ a data file and the index file describing it """
+
+    def __init__(self, data, index):
+        self.data = data
+        self.index = index
+
+    def flush(self):
+        # data first, so a reader never sees an index record for unwritten bytes
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.data.close()
+            self.index.close()
+
+
+class FileWriter():
+    """
+    Writes queued items in a background thread.
+
+    `write(files, item)` runs in the thread for every item. `files` is a dictionary
+    the callback keeps its open files in, e.g. by camera; the thread flushes and
+    finally closes them. An OSError raised by the callback loses that item only;
+    the callback must not leave a closed file in `files`.
+    """
+
+    def __init__(self, write, name, queue_size=QUEUE_SIZE):
+        self._write = write
+        self._name = name
+        self._queue = queue.Queue(queue_size)
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def dropped(self) -> int:
+        ''' items dropped because the writer thread fell behind '''
+        return self._dropped
+
+    def put(self, item):
+        ''' queues an item; drops it if the queue is full '''
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._dropped += 1
+
+    async def close(self):
+        ''' writes the queued items, closes the files and waits for the thread '''
+        self._queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+
+    def _run(self):
+        files = {}
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_SECONDS)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                try:
+                    self._write(files, item)
+                except OSError as e:
+                    _LOGGER.error('%s: %s', self._name, e)
+            if time.monotonic() - last_flush >= FLUSH_SECONDS:
+                self._each(files, 'flush')
+                last_flush = time.monotonic()
+        self._each(files, 'close')
+
+    def _each(self, files, method):
+        for key, f in list(files.items()):
+            try:
+                getattr(f, method)()
+            except OSError as e:
+                _LOGGER.error('%s: %s %s: %s', self._name, method, key, e)
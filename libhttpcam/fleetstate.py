@@ -0,0 +1,103 @@
+#
+# Columnar state store for large fleets.
+#
+# Rather than one object or dictionary per camera, the latest known values are
+# kept in one typed array per column, indexed by a camera's row number. For the
+# default columns a camera costs a few dozen bytes.
+#
+
+import time
+from array import array
+from libhttpcam.httpcam import Trigger, Action, IRmode
+
+UNKNOWN = -1    # value of integer columns that have not been set
+
+DEFAULT_COLUMNS = {
+    'motion':       'b',    # Trigger.motion
+    'audio':        'b',    # Trigger.audio
+    'alarm_audio':  'b',    # Action.audio
+    'ftp_snap':     'b',    # Action.ftp_snap
+    'ftp_rec':      'b',    # Action.ftp_rec
+    'ir_led':       'b',    # IRmode.LED
+    'ir_sensor':    'b',    # IRmode.Sensor
+    'alarm':        'b',    # async_get_alarm_triggered
+    'updated':      'd',    # time of the last update
+}
+
+
+def _flag(value) -> int:
+    ''' maps the brands' status values (bool, 'on', 'open', '1') to 0/1 '''
+    if isinstance(value, str):
+        return 1 if value in ('1', 'on', 'open') else 0
+    return 1 if value else 0
+
+
+class FleetState():
+    """ latest known values of many cameras, stored column-wise in arrays """
+
+    def __init__(self, columns=None):
+        '''
+        columns: dictionary of column name -> array typecode, defaults to DEFAULT_COLUMNS
+        '''
+        self._types = dict(DEFAULT_COLUMNS if columns is None else columns)
+        self._columns = {name: array(code) for name, code in self._types.items()}
+        self._rows = {}     # cam_id -> row
+        self._ids = []      # row -> cam_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, cam_id):
+        return cam_id in self._rows
+
+    def row(self, cam_id) -> int:
+        ''' returns the camera's row, adding the camera on first use '''
+        row = self._rows.get(cam_id)
+        if row is None:
+            row = self._rows[cam_id] = len(self._ids)
+            self._ids.append(cam_id)
+            for name, column in self._columns.items():
+                column.append(UNKNOWN if self._types[name] not in 'fd' else 0.0)
+        return row
+
+    def cam_id(self, row):
+        return self._ids[row]
+
+    def column(self, name) -> array:
+        ''' the column's array, one value per row '''
+        return self._columns[name]
+
+    def set(self, cam_id, **values):
+        row = self.row(cam_id)
+        for name, value in values.items():
+            self._columns[name][row] = value
+        if 'updated' in self._columns:
+            self._columns['updated'][row] = time.time()
+
+    def get(self, cam_id, name):
+        ''' returns the value, or None if the camera or value is unknown '''
+        row = self._rows.get(cam_id)
+        if row is None:
+            return None
+        value = self._columns[name][row]
+        return None if value == UNKNOWN and self._types[name] not in 'fd' else value
+
+    def values(self, cam_id) -> dict:
+        return {name: self.get(cam_id, name) for name in self._columns}
+
+    #
+    # ------------------
+    # Updates from the camera query results
+    #
+    def set_trigger(self, cam_id, trigger: Trigger):
+        self.set(cam_id, motion=_flag(trigger.motion), audio=_flag(trigger.audio))
+
+    def set_action(self, cam_id, action: Action):
+        self.set(cam_id, alarm_audio=_flag(action.audio), ftp_snap=_flag(action.ftp_snap),
+                 ftp_rec=_flag(action.ftp_rec))
+
+    def set_irmode(self, cam_id, irmode: IRmode):
+        self.set(cam_id, ir_led=_flag(irmode.LED), ir_sensor=_flag(irmode.Sensor))
+
+    def set_alarm(self, cam_id, triggered: bool):
+        self.set(cam_id, alarm=_flag(triggered))
@@ -1,7 +1,10 @@
 import time
 import re
-from libhttpcam.httpcam import HttpCam, Response, Status, IRmode, Action, Trigger
+from libhttpcam.httpcam import HttpCam, HttpCamError, Response, Status, IRmode, Action, Trigger, Profile
 from libhttpcam.httpcam import NTP_SERVER, RESULT_CODE
+from libhttpcam.scheduler import Priority
+from libhttpcam.results import FoscamMotionDetectConfig
+from libhttpcam.cmdplan import CommandPlan
 import logging
 # import xml.etree.ElementTree as ET
 
@@ -25,9 +28,17 @@ ALARM_ACTION = {
 
 CMD_PATH = 'cgi-bin/CGIProxy.fcgi'
 
+STREAM_CMDS = ('snapPicture', 'snapPicture2', 'GetMJStream')
+ALARM_CMDS = ('getDevState',)
+
 LED_MODE_AUTO = 0
 LED_MODE_MANUAL = 1
 
+SUB_STREAM_MJPEG = 1    # setSubStreamFormat: 0: H.264, 1: MJPEG
+# sub stream resolutions: 0: 720P, 1: VGA 640x480, 2: VGA 640x360, 3: QVGA 320x240, 4: QVGA 320x180
+PREVIEW_RESOLUTION = 3
+PREVIEW_RESOLUTIONS = ('1', '2', '3', '4')      # sub stream resolutions serving the preview profile
+
 
 def motionSensitityMap(sensitivity):
     if (sensitivity < 20):      # lowest
@@ -44,10 +55,10 @@ def motionSensitityMap(sensitivity):
 class Foscam(HttpCam):
     """ http-based communication routines for FOSCAM cameras. """
 
-    def __init__(self, url, port=None):
+    def __init__(self, url, port=None, session=None):
         if port is None:
             port = 88
-        super(Foscam, self).__init__('Foscam', url, port)
+        super(Foscam, self).__init__('Foscam', url, port, session)
         self.arm_cmd = None
 
     def _getQueryPath(self, cmd, paramStr):
@@ -55,6 +66,55 @@ class Foscam(HttpCam):
             paramStr = '&' + paramStr
         return '%s?cmd=%s%s&usr=%s&pwd=%s' % (CMD_PATH, cmd, paramStr, self._usr, self._pwd)
 
+    def _getStreamURL(self, profile=Profile.FULL):
+        ''' GetMJStream always delivers the sub stream; the main stream is H.264 only '''
+        return self._getQueryURL('GetMJStream', '')
+
+    async def _async_detect_profile(self, profile: Profile) -> dict:
+        '''
+        Both profiles stream the MJPEG sub stream, which serves the preview profile
+        only at a reduced resolution; see `async_set_sub_stream`.
+        Foscam snapshots always have the main stream resolution.
+        '''
+        full = profile == Profile.FULL
+        code, fmt = await self._async_fetch('getSubStreamFormat', [])
+        mjpeg = code == RESULT_CODE['0'] and fmt.get('format') == str(SUB_STREAM_MJPEG)
+        if mjpeg and not full:
+            code, params = await self._async_fetch('getSubVideoStreamParam', [])
+            mjpeg = code == RESULT_CODE['0'] and params.get('resolution') in PREVIEW_RESOLUTIONS
+        return {'snapshot': full, 'stream': mjpeg, 'sub_stream': True}
+
+    async def async_set_sub_stream(self, resolution=PREVIEW_RESOLUTION) -> Response:
+        '''
+        switches the sub stream, and with it the MJPEG stream of both profiles,
+        to MJPEG at `resolution`, e.g. PREVIEW_RESOLUTION for dashboard tiles or 0 (720P).
+        This changes the camera's configuration for all its clients.
+        '''
+        self._profiles = {}     # detect the profiles again on next use
+        code, result = await self._async_fetch('setSubStreamFormat', [('format', SUB_STREAM_MJPEG)])
+        if code != RESULT_CODE['0']:
+            return (code, result)
+        code, params = await self._async_fetch('getSubVideoStreamParam', [])
+        if code != RESULT_CODE['0']:
+            return (code, params)
+        if params.get('resolution') == str(resolution):
+            return (code, params)
+        # the set command requires all parameters; keep the current ones
+        return await self._async_fetch('setSubVideoStreamParam', [
+            ('resolution',  resolution),
+            ('bitRate',     params.get('bitRate', 256000)),
+            ('frameRate',   params.get('frameRate', 10)),
+            ('GOP',         params.get('GOP', 10)),
+            ('isVBR',       params.get('isVBR', 1))
+        ])
+
+    def _requestPriority(self, cmd, params):
+        if cmd in STREAM_CMDS:
+            return Priority.STREAM
+        if cmd in ALARM_CMDS:
+            return Priority.ALARM
+        return Priority.READ if cmd.startswith('get') else Priority.WRITE
+
     def _parseResult(self, result, params):
         p = re.compile(r'.*?<(?P<first>\S*?)>(\S*?)<\/(?P=first)>')
         d = dict(p.findall(result))
@@ -79,10 +139,22 @@ class Foscam(HttpCam):
             ('devName', name),
         ])
 
+    async def async_run_plan(self, plan: CommandPlan) -> Response:
+        '''
+        runs the commands of a CommandPlan, independent ones concurrently,
+        and returns their merged Response
+        '''
+        return await plan.run(self)
+
     async def async_set_system_time(self) -> Response:
         ''' Set system time '''
+        return await self.async_run_plan(self.system_time_plan())
+
+    def system_time_plan(self) -> CommandPlan:
+        ''' the commands of async_set_system_time '''
         _t = time.localtime()
-        return await self._async_fetch('setSystemTime', [
+        plan = CommandPlan()
+        plan.add('setSystemTime', [
             ('timeSource',    1),
             ('ntpServer',     NTP_SERVER[0]),
             ('dateFormat',    0),
@@ -97,20 +169,28 @@ class Foscam(HttpCam):
             ('minute',        _t[4]),
             ('sec',           _t[5])
         ])
+        return plan
 
     async def async_set_irled(self, status: Status) -> Response:
         ''' sets just the IR LED status: STATUS_ON, STATUS_OFF, STATUS_AUTO '''
+        return await self.async_run_plan(self.irled_plan(status))
+
+    def irled_plan(self, status: Status) -> CommandPlan:
+        ''' the commands of async_set_irled '''
+        plan = CommandPlan()
         if status == Status.STATUS_AUTO:
             _LOGGER.info('setting IR to STATUS_AUTO: %s', status)
-            await self._async_fetch('setInfraLedConfig', [('mode', LED_MODE_AUTO)])
+            plan.add('setInfraLedConfig', [('mode', LED_MODE_AUTO)])
         else:   # STATUS_ON or STATUS_OFF
-            await self._async_fetch('setInfraLedConfig', [('mode', LED_MODE_MANUAL)])
+            # the LED can only be switched in manual mode
+            manual = plan.add('setInfraLedConfig', [('mode', LED_MODE_MANUAL)])
             if (status == Status.STATUS_ON):
                 _LOGGER.info('setting IR to STATUS_ON: %s', status)
-                await self._async_fetch('openInfraLed', [])
+                plan.add('openInfraLed', after=[manual])
             else:
                 _LOGGER.info('setting IR to STATUS_OFF: %s', status)
-                await self._async_fetch('closeInfraLed', [])
+                plan.add('closeInfraLed', after=[manual])
+        return plan
 
     async def async_set_night_mode(self, status: Status) -> Response:
         '''
@@ -159,9 +239,9 @@ class Foscam(HttpCam):
         '''
         return IRmode(LED=False, Sensor=False)
 
-    async def async_get_alarm_trigger(self) -> Trigger:
+    async def async_get_motion_detect_config(self) -> Response:
         """
-        Return the current motion detection configuration.
+        Return the current motion detection configuration as FoscamMotionDetectConfig.
         Fetch returns: ('Success', {
             'isEnable': '0', 'linkage': '13', 'snapInterval': '1',
             'sensitivity': '2', 'triggerInterval': '5', 'isMovAlarmEnable': '1',
@@ -171,34 +251,25 @@ class Foscam(HttpCam):
             'area2': '1023', 'area3': '1023', 'area4': '1023', 'area5': '1023', 'area6': '1023', 'area7': '1023',
             'area8': '1023', 'area9': '1023'})
         """
-        result = await self._async_fetch('getMotionDetectConfig', [])
-        # _LOGGER.warn('async_get_motion_detection %s\n%s', self._host, result)
-        return Trigger(audio=False, motion=True if result[1]['isEnable'] == '1' else False)
+        code, result = await self._async_fetch('getMotionDetectConfig', [])
+        if isinstance(result, dict):
+            result = FoscamMotionDetectConfig.from_dict(result)
+        return (code, result)
+
+    async def _async_motion_detect_config(self) -> FoscamMotionDetectConfig:
+        code, config = await self.async_get_motion_detect_config()
+        # _LOGGER.warn('async_get_motion_detection %s\n%s', self._host, config)
+        if code != RESULT_CODE['0'] or not isinstance(config, FoscamMotionDetectConfig):
+            raise HttpCamError('getMotionDetectConfig failed: %s' % code, self)
+        return config
+
+    async def async_get_alarm_trigger(self) -> Trigger:
+        """ Return the current motion detection trigger. """
+        return (await self._async_motion_detect_config()).trigger
 
     async def async_get_alarm_action(self) -> Action:
-        """
-        Return the current motion detection configuration.
-        Fetch returns: ('Success', {
-            'isEnable': '0', 'linkage': '13', 'snapInterval': '1',
-            'sensitivity': '2', 'triggerInterval': '5', 'isMovAlarmEnable': '1',
-            'isPirAlarmEnable': '1', 'schedule0': '281474976710655', 'schedule1': '281474976710655',
-            'schedule2': '281474976710655', 'schedule3': '281474976710655', 'schedule4': '281474976710655',
-            'schedule5': '281474976710655', 'schedule6': '281474976710655', 'area0': '1023', 'area1': '1023',
-            'area2': '1023', 'area3': '1023', 'area4': '1023', 'area5': '1023', 'area6': '1023', 'area7': '1023',
-            'area8': '1023', 'area9': '1023'})
-        """
-        result = await self._async_fetch('getMotionDetectConfig', [])
-        # _LOGGER.warn('async_get_motion_detection %s\n%s', self._host, result)
-        link = int(result[1]['linkage'])
-        return Action(
-            audio=True if link & ALARM_ACTION['audio'] else False,
-            ftp_snap=True if link & ALARM_ACTION['pic'] else False,
-            ftp_rec=True if link & ALARM_ACTION['video'] else False
-        )
-
-    async def async_get_alarm_triggered(self) -> bool:
-        ''' returns True if the camera has detected an alarm. '''
-        return False
+        """ Return the current motion detection actions, decoded from the `linkage` bitmask. """
+        return (await self._async_motion_detect_config()).action
 
     async def async_get_ftp_config(self) -> Response:
         ''' gets up the ftp settings on foscam '''
@@ -212,26 +283,31 @@ class Foscam(HttpCam):
     # Device actions
     #
 
-    async def async_snap_picture(self):
+    async def _async_snap_picture(self, profile=Profile.FULL, pool=None):
         ''' Manually request snapshot. Returns raw JPEG data. '''
-        return await self._async_fetch('snapPicture2', {}, raw=True)
+        return await self._async_fetch('snapPicture2', {}, raw=True, pool=pool)
 
     async def async_mjpeg_stream(self, request):
         return await self._async_fetch('GetMJStream', {}, raw=True)
 
     async def async_set_alarm(self, trigger: Trigger, action: Action) -> Response:
         ''' Get the current config and set the motion detection on or off '''
+        return await self.async_run_plan(self.alarm_plan(trigger, action))
 
+    def alarm_plan(self, trigger: Trigger, action: Action) -> CommandPlan:
+        ''' the commands of async_set_alarm '''
         # check if camera supports motion detection
         # code, result = await self.async_get_motion_detect_config()
         # if code != RESULT_CODE['0']:    # unsuccessful
         #     return (code, result)
 
-        await self._async_fetch('setAlarmRecordConfig', [
+        # the record and motion detection configs are independent and sent concurrently
+        plan = CommandPlan()
+        plan.add('setAlarmRecordConfig', [
             ('isEnablePreRecord',    1),
             ('preRecordSecs',        5),
             ('alarmRecordSecs',      30)
-        ])
+        ], optional=True)    # not all cameras record; arming must not depend on it
         if not self.arm_cmd:
             schedule = ''
             area = ''
@@ -253,7 +329,11 @@ class Foscam(HttpCam):
             ('sensitivity',      motionSensitityMap(self.motion_sensitivity)),    # low - high: 4, 3, 0, 1, 2
             ('snapInterval',     '1'),    # in seconds# in seconds
             ('triggerInterval',  '5')]    # in seconds
-        return await self._async_fetch(self.arm_cmd, params)
+        plan.add(self.arm_cmd, params, name='setMotionDetectConfig')
+        return plan
 
-    async def async_ptz_preset(self, preset_pos:int):
-        return (RESULT_CODE['0'], '')
+    async def _async_ptz_goto(self, preset_pos) -> Response:
+        ''' Foscam presets are named; numbers are passed as their string name '''
+        return await self._async_fetch('ptzGotoPresetPoint', [
+            ('name', preset_pos)
+        ])
@@ -1,8 +1,12 @@
 import aiohttp
 import logging
+import re
+import time
 from typing import Tuple
 from collections import namedtuple
 from enum import Enum
+from .mjpeg import MjpegParser
+from .scheduler import Priority, scheduler_for
 
 name = "libhhttpcam"
 
@@ -20,6 +24,8 @@ RESULT_CODE = {
     '-8': 'Disconnected or not a camera'
 }
 
+ALARM_HOLD = 30     # seconds a pushed alarm is reported by async_get_alarm_triggered
+
 NTP_SERVER = [
     'time.nist.gov',
     'time.kriss.re.kr',
@@ -34,6 +40,11 @@ class Status(Enum):
     STATUS_AUTO = 'auto'
 
 
+class Profile(Enum):
+    FULL = 'full'           # main stream resolution, for recording and archiving
+    PREVIEW = 'preview'     # reduced resolution, for dashboards and thumbnails
+
+
 Trigger = namedtuple('Trigger', ['motion', 'audio'])
 Action = namedtuple('Action', ['audio', 'ftp_snap', 'ftp_rec'])
 IRmode = namedtuple('IRmode', ['LED', 'Sensor'])
@@ -41,6 +52,11 @@ IRmode = namedtuple('IRmode', ['LED', 'Sensor'])
 Response = Tuple[str, str]
 
 
+def redactURL(url: str) -> str:
+    ''' masks credentials in query strings, e.g. Foscam's `usr=...&pwd=...`, for logging '''
+    return re.sub(r'((?:usr|pwd)=)[^&]*', r'\1***', url)
+
+
 def cmdConcat(p):
     if isinstance(p, list):
         return '&'.join(cmdConcat(e) for e in p)
@@ -60,12 +76,19 @@ class HttpCamError(Exception):
 class HttpCam():
     """ http-based communication routines for FOSCAM cameras. """
 
-    def __init__(self, brand, host, port):
+    def __init__(self, brand, host, port, session=None):
         self._brand = brand
         self._model = None
         self._host = host
         self._port = port
-        self._session = aiohttp.ClientSession()
+        self._session = aiohttp.ClientSession() if session is None else session
+        self._ptz = None
+        self._scheduler = scheduler_for(host)
+        self._streams = 0               # open async_mjpeg_frames streams
+        self._stream_frame = None       # (monotonic time, latest frame, Profile)
+        self._snap_max_age = None       # serve snapshots from a live stream if set
+        self._alarm_time = None         # monotonic time of the last pushed alarm
+        self._profiles = {}             # Profile -> {'snapshot': bool, 'stream': bool}
         self.set_credentials()
         self.set_sensitivities(motion=50, audio=50)
         _LOGGER.info('HttpCam %s @%s:%s', brand, host, port)
@@ -86,31 +109,129 @@ class HttpCam():
         # paramstr = urllib.parse.quote_plus(paramStr)
         return 'http://%s:%s/%s' % (self._host, self._port, paramstr)
 
-    async def _async_get(self, url, raw=False):
+    async def _async_request(self, url):
+        '''
+        asyncronously sends a GET request for the supplied URL and returns the response.
+        '''
+        return await self._session.get(url)
+
+    async def _async_get(self, url, raw=False, pool=None):
         '''
         asyncronously sends a GET command for the supplied URL and
-        if raw == True, returns the raw result, else returns a a text result
+        if raw == True, returns the raw result, else returns a a text result.
+        With a BufferPool supplied, raw results are returned as a PooledBuffer.
         '''
         if self._session is None:
             _LOGGER.warn('_async_get: session not defined')
         else:
-            _LOGGER.debug('async get %s', url)
-            async with self._session.get(url) as response:
+            _LOGGER.debug('async get %s', redactURL(url))
+            response = await self._async_request(url)
+            try:
+                if raw and pool is not None:
+                    return await self._async_read_into(response, pool)
                 return await response.read() if raw else await response.text()
+            finally:
+                response.release()
+
+    async def _async_read_into(self, response, pool):
+        '''
+        reads the response body into a pooled buffer, sized by Content-Length
+        or by the size last seen for this camera.
+        '''
+        content = getattr(response, 'content', None)
+        if content is None:
+            # a session that reads whole bodies, e.g. LeanSession: wrap the body, a copy would only add
+            return pool.wrap(await response.read())
+        length = response.headers.get('Content-Length')
+        buf = pool.acquire(int(length) if length else None, self._host)
+        try:
+            async for chunk in content.iter_chunked(64*1024):
+                buf.write(chunk)
+        except BaseException:
+            buf.release()
+            raise
+        pool.observe(self._host, len(buf))
+        return buf
+
+    async def _async_stream(self, url, chunk_size=64*1024):
+        '''
+        asyncronously GETs the supplied URL and yields the body in chunks
+        as they arrive. Requires a session with streaming support (aiohttp).
+        Long-lived streams bypass the request scheduler, so they cannot
+        hold its slots indefinitely.
+        '''
+        _LOGGER.debug('async stream %s', redactURL(url))
+        async with self._session.get(url) as response:
+            content = getattr(response, 'content', None)
+            if content is None:
+                raise HttpCamError('streaming not supported by %s' % type(self._session).__name__, self)
+            async for chunk in content.iter_chunked(chunk_size):
+                yield chunk
+
+    def _getStreamURL(self, profile=Profile.FULL) -> str:
+        '''
+        a camera model-specific URL for the profile's MJPEG stream, or None if not available.
+        '''
+        return None
 
-    async def _async_fetch(self, cmd, params, raw=False) -> Response:
+    async def _async_detect_profile(self, profile: Profile) -> dict:
+        '''
+        a camera model-specific check of the profile's capabilities. Only queries the
+        camera, never changes its configuration. Returns {'snapshot': bool, 'stream': bool,
+        'sub_stream': bool}; `sub_stream` is True if the profile's stream is the camera's sub stream.
+        '''
+        full = profile == Profile.FULL
+        return {'snapshot': full, 'stream': full and self._getStreamURL(profile) is not None, 'sub_stream': False}
+
+    async def _async_profile(self, profile, kind) -> Profile:
+        '''
+        returns `profile` if the camera supports it for `kind` ('snapshot' or 'stream'),
+        else Profile.FULL. Capabilities are detected on first use of a profile.
+        '''
+        profile = Profile(profile)
+        if profile == Profile.FULL:
+            return profile
+        caps = await self._async_profile_caps(profile)
+        return profile if caps[kind] else Profile.FULL
+
+    async def _async_profile_caps(self, profile) -> dict:
+        ''' the profile's capabilities, detected on first use '''
+        caps = self._profiles.get(profile)
+        if caps is None:
+            try:
+                caps = await self._async_detect_profile(profile)
+            except Exception as e:
+                _LOGGER.warn('%s: %s profile detection failed: %s', self._host, profile.value, e)
+                caps = {'snapshot': profile == Profile.FULL, 'stream': False, 'sub_stream': False}
+            self._profiles[profile] = caps
+            _LOGGER.info('%s: %s profile: %s', self._host, profile.value, caps)
+        return caps
+
+    def _requestPriority(self, cmd, params) -> Priority:
+        '''
+        a camera model-specific scheduling class for the command.
+        '''
+        return Priority.READ
+
+    async def _async_fetch(self, cmd, params, raw=False, priority=None, pool=None) -> Response:
         '''
         asyncronously fetches the response to the command and
         returns a tuple containing
         - a textual result code
         - and a dictionary of results
+        Requests to the same host are queued by `priority`, defaulting
+        to the class returned by `_requestPriority`. Raw results are read
+        into a buffer from `pool` if supplied.
         '''
         # _LOGGER.warn(params)
         code = RESULT_CODE['0']
         paramstr = cmdConcat(params) if params else ''
 
         cmdurl = self._getQueryURL(cmd, paramstr)
-        result = await self._async_get(cmdurl, raw)
+        if priority is None:
+            priority = self._requestPriority(cmd, params)
+        async with self._scheduler.slot(priority):
+            result = await self._async_get(cmdurl, raw, pool)
         if isinstance(result, str):
             (code, result) = self._parseResult(result, params)
         return (code, result)
@@ -130,6 +251,18 @@ class HttpCam():
         self.motion_sensitivity = motion
         self.audio_sensitivity = audio
 
+    def set_snapshot_from_stream(self, max_age=1.0):
+        '''
+        lets async_snap_picture return the latest frame of an open MJPEG stream
+        if it is at most `max_age` seconds old, instead of sending a request.
+        `max_age=None` disables this.
+        '''
+        self._snap_max_age = max_age
+
+    def set_max_concurrency(self, limit=2):
+        ''' sets the maximum number of concurrent requests sent to the camera's host '''
+        self._scheduler.limit = limit
+
     async def async_reboot(self) -> Response:
         raise HttpCamError('async_reboot not available', self)
 
@@ -176,6 +309,11 @@ class HttpCam():
     def port(self):
         return self._port
 
+    @property
+    def scheduler(self):
+        ''' the request scheduler shared by all cameras on this host; see `scheduler.stats()` '''
+        return self._scheduler
+
     async def async_get_model(self) -> str:
         ''' gets the camera's model '''
         raise HttpCamError('async_get_model not available', self)
@@ -197,9 +335,24 @@ class HttpCam():
         ''' gets the camera's alarm action settings '''
         raise HttpCamError('async_get_alarm_action not available', self)
 
+    async def async_get_profiles(self) -> dict:
+        '''
+        returns the camera's stream profiles and their capabilities, e.g.
+        {Profile.FULL: {'snapshot': True, 'stream': True, 'sub_stream': False}, Profile.PREVIEW: {...}}
+        Detection only queries the camera.
+        '''
+        return {profile: await self._async_profile_caps(profile) for profile in Profile}
+
     async def async_get_alarm_triggered(self) -> bool:
-        ''' returns True if the camera has detected an alarm. '''
-        return False
+        '''
+        returns True if the camera has detected an alarm within the last ALARM_HOLD seconds.
+        Alarms are pushed by uploads to a libhttpcam.receiver.UploadReceiver.
+        '''
+        return self._alarm_time is not None and time.monotonic() - self._alarm_time <= ALARM_HOLD
+
+    def notify_alarm(self):
+        ''' records an alarm reported by the camera, e.g. through an upload '''
+        self._alarm_time = time.monotonic()
 
     async def async_get_ftp_config(self) -> Response:
         ''' gets the camera's ftp configuration '''
@@ -209,26 +362,113 @@ class HttpCam():
     # ------------------
     # Device actions
     #
-    async def async_snap_picture(self):
+    async def async_snap_picture(self, profile=Profile.FULL):
+        '''
+        snaps a picture and returns (code, JPEG bytes).
+        `profile` selects the resolution; Profile.PREVIEW falls back to Profile.FULL
+        if the camera has no reduced resolution snapshot.
+        '''
+        return await self._async_snap(profile, None)
+
+    async def async_snap_picture_pooled(self, pool, profile=Profile.FULL):
+        '''
+        like async_snap_picture, but reads the JPEG into a buffer from `pool`, a
+        libhttpcam.bufferpool.BufferPool, and returns (code, PooledBuffer) on success.
+        The caller must `release()` the buffer when done.
+        '''
+        return await self._async_snap(profile, pool)
+
+    async def _async_snap(self, profile, pool):
+        profile = await self._async_profile(profile, 'snapshot')
+        if self._snap_max_age is not None and self._streams and self._stream_frame is not None:
+            stamp, frame, stream_profile = self._stream_frame
+            if (stream_profile == profile and time.monotonic() - stamp <= self._snap_max_age
+                    and await self._async_stream_matches_snapshot(profile)):
+                return (RESULT_CODE['0'], frame if pool is None else pool.copy(frame))
+        return await self._async_snap_picture(profile, pool)
+
+    async def _async_stream_matches_snapshot(self, profile) -> bool:
+        '''
+        whether the profile's stream frames have its snapshot resolution. A full
+        profile streaming the sub stream (Foscam) does not: its snapshots are main stream.
+        '''
+        return profile == Profile.PREVIEW or not (await self._async_profile_caps(profile))['sub_stream']
+
+    async def _async_snap_picture(self, profile=Profile.FULL, pool=None):
         raise HttpCamError('async_snap_picture not available', self)
 
     async def async_mjpeg_stream(self, request):
         raise HttpCamError('async_mjpeg_stream not available', self)
 
+    def async_mjpeg_frames(self, profile=Profile.FULL):
+        '''
+        opens the camera's MJPEG stream and asyncronously yields
+        the individual JPEG frames as bytes.
+        `profile` selects the stream; Profile.PREVIEW falls back to Profile.FULL
+        if the camera has no reduced resolution stream.
+        '''
+        return self._async_frames(profile, None)
+
+    def async_mjpeg_frames_pooled(self, pool, profile=Profile.FULL):
+        '''
+        like async_mjpeg_frames, but yields each frame as a PooledBuffer from `pool`,
+        a libhttpcam.bufferpool.BufferPool. The caller must `release()` each frame.
+        '''
+        return self._async_frames(profile, pool)
+
+    async def _async_frames(self, profile, pool):
+        profile = await self._async_profile(profile, 'stream')
+        url = self._getStreamURL(profile)
+        if url is None:
+            raise HttpCamError('async_mjpeg_frames not available', self)
+        parser = MjpegParser()
+        self._streams += 1
+        try:
+            async for chunk in self._async_stream(url):
+                for frame in parser.feed(chunk, pool):
+                    if self._snap_max_age is not None:
+                        self._stream_frame = (time.monotonic(), frame if pool is None else frame.tobytes(), profile)
+                    yield frame
+        finally:
+            self._streams -= 1
+            if not self._streams:
+                self._stream_frame = None
+
     async def async_set_alarm(self, trigger: Trigger, action: Action) -> Response:
         raise HttpCamError('async_set_alarm not available', self)
 
-    async def async_ptz_preset(self, preset_pos:int):
+    async def async_ptz_preset(self, preset_pos:int) -> Response:
+        '''
+        moves to a predefined PTZ position. Moves are serialized; requests arriving
+        while the camera is moving are coalesced and only the latest is executed.
+        '''
+        if preset_pos is None:
+            return (RESULT_CODE['0'], '')
+        if self._ptz is None:
+            from libhttpcam.ptz import PtzController
+            self._ptz = PtzController(self)
+        return await self._ptz.goto(preset_pos)
+
+    async def _async_ptz_configure(self) -> Response:
+        ''' applies the motor configuration needed for preset moves; called once per camera '''
+        return (RESULT_CODE['0'], '')
+
+    async def _async_ptz_goto(self, preset_pos) -> Response:
         raise HttpCamError('async_ptz_preset not available', self)
 
 
-def createCam(brand:str, ip:str, port:int=None) -> (HttpCam, int):
+def createCam(brand:str, ip:str, port:int=None, session=None) -> (HttpCam, int):
+    '''
+    creates a camera instance for `brand`.
+    `session` optionally supplies the HTTP transport: an aiohttp.ClientSession
+    or a libhttpcam.leanhttp.LeanSession. Defaults to a new aiohttp.ClientSession.
+    '''
     if brand.lower() == 'foscam':
         from libhttpcam.foscam import Foscam
-        Cam = Foscam(ip, port)
+        Cam = Foscam(ip, port, session)
         return (Cam, Cam.port)
     if brand.lower() == 'wansview':
         from libhttpcam.wansview import Wansview
-        Cam = Wansview(ip, port)
+        Cam = Wansview(ip, port, session)
         return (Cam, Cam.port)
     raise HttpCamError("unknown camera brand {} @{}".format(brand, ip))
@@ -0,0 +1,241 @@
+#
+# Minimal HTTP/1.1 client on top of asyncio streams.
+#
+# Covers the narrow subset of HTTP spoken by the cameras' embedded web servers:
+# GET requests with small query strings, Content-Length / chunked / close-delimited
+# bodies, and keep-alive connection reuse. It mimics the parts of
+# aiohttp.ClientSession used by HttpCam and DigestAuth, so either can be passed
+# as the `session` of a camera.
+#
+
+import asyncio
+import logging
+from urllib.parse import urlsplit
+from libhttpcam.httpcam import HttpCamError
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10        # seconds per request
+MAX_IDLE_PER_HOST = 2       # cameras rarely accept more than two parallel connections
+
+
+class LeanHeaders(dict):
+    ''' response headers, with case-insensitive `get` and item access '''
+
+    def __getitem__(self, key):
+        return super(LeanHeaders, self).__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super(LeanHeaders, self).__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super(LeanHeaders, self).get(key.lower(), default)
+
+
+class LeanResponse():
+    ''' a fully read response, exposing the aiohttp.ClientResponse calls used in this library '''
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding=None) -> str:
+        if encoding is None:
+            encoding = 'utf-8'
+            ctype = self.headers.get('content-type', '')
+            for part in ctype.split(';'):
+                key, _, value = part.strip().partition('=')
+                if key.lower() == 'charset' and value:
+                    encoding = value.strip('"')
+        return self._body.decode(encoding, errors='replace')
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class _RequestContext():
+    ''' allows both `await session.get(url)` and `async with session.get(url) as response` '''
+
+    def __init__(self, coro):
+        self._coro = coro
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class LeanSession():
+    """
+    Keep-alive HTTP/1.1 client built on asyncio.open_connection.
+    Drop-in replacement for the aiohttp.ClientSession passed to HttpCam.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self._timeout = timeout
+        self._max_idle = max_idle_per_host
+        self._idle = {}         # (host, port) -> [(reader, writer), ...]
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def get(self, url, *, headers=None, **kwargs) -> _RequestContext:
+        return _RequestContext(self._request('GET', url, headers))
+
+    def request(self, method, url, *, headers=None, **kwargs) -> _RequestContext:
+        return _RequestContext(self._request(method, url, headers))
+
+    async def close(self):
+        self._closed = True
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle = {}
+
+    #
+    # ------------------
+    # Connection pool
+    #
+    async def _acquire(self, key, deadline):
+        conns = self._idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return (reader, writer, True)
+            writer.close()
+        reader, writer = await self._connect(key, deadline)
+        return (reader, writer, False)
+
+    async def _connect(self, key, deadline):
+        ''' opens a connection, failing at `deadline` rather than at the OS connect timeout '''
+        return await asyncio.wait_for(asyncio.open_connection(key[0], key[1]), _remaining(deadline))
+
+    def _release(self, key, reader, writer, reusable):
+        conns = self._idle.setdefault(key, [])
+        if reusable and not self._closed and len(conns) < self._max_idle:
+            conns.append((reader, writer))
+        else:
+            writer.close()
+
+    #
+    # ------------------
+    # Request / response
+    #
+    async def _request(self, method, url, headers) -> LeanResponse:
+        if self._closed:
+            raise HttpCamError('LeanSession is closed')
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise HttpCamError('LeanSession supports only http URLs, got %s' % url)
+        key = (parts.hostname, parts.port or 80)
+        target = parts.path or '/'
+        if parts.query:
+            target = '%s?%s' % (target, parts.query)
+        lines = ['%s %s HTTP/1.1' % (method, target),
+                 'Host: %s' % parts.netloc.rpartition('@')[2],
+                 'Connection: keep-alive']
+        for name, value in (headers or {}).items():
+            lines.append('%s: %s' % (name, value))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        # one deadline covers connecting, a reconnect and the exchange
+        deadline = asyncio.get_running_loop().time() + self._timeout
+        reader, writer, reused = await self._acquire(key, deadline)
+        try:
+            return await asyncio.wait_for(self._exchange(key, url, method, head, reader, writer),
+                                          _remaining(deadline))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+        except BaseException:
+            writer.close()
+            raise
+        # the camera dropped an idle keep-alive connection: retry once on a fresh one
+        _LOGGER.debug('stale connection to %s:%s, reconnecting', key[0], key[1])
+        reader, writer = await self._connect(key, deadline)
+        try:
+            return await asyncio.wait_for(self._exchange(key, url, method, head, reader, writer),
+                                          _remaining(deadline))
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _exchange(self, key, url, method, head, reader, writer) -> LeanResponse:
+        writer.write(head)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        try:
+            version, status, reason = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        except ValueError:
+            version, status = status_line.decode('latin-1').split()[:2]
+            reason = ''
+        headers = LeanHeaders()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        status = int(status)
+        connection = headers.get('connection', '').lower()
+        reusable = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+
+        self._release(key, reader, writer, reusable)
+        return LeanResponse(url, status, reason, headers, body)
+
+    @staticmethod
+    async def _read_chunked(reader) -> bytes:
+        body = bytearray()
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                # connection closed before the terminating chunk
+                raise asyncio.IncompleteReadError(bytes(body), None)
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # skip optional trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+
+def _remaining(deadline) -> float:
+    return max(deadline - asyncio.get_running_loop().time(), 0)
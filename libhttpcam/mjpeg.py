@@ -0,0 +1,52 @@
+#
+# Motion-JPEG stream helpers.
+#
+# Cameras deliver MJPEG as multipart/x-mixed-replace: boundary and part headers
+# followed by a JPEG image, repeated. The parser below does not interpret the
+# multipart framing; it cuts frames at the JPEG start (FFD8) and end (FFD9)
+# markers, which works regardless of boundary names or missing part headers.
+#
+
+SOI = b'\xff\xd8'       # JPEG start of image
+EOI = b'\xff\xd9'       # JPEG end of image
+
+MAX_FRAME_SIZE = 8 * 1024 * 1024    # drop garbage rather than buffering without bound
+
+
+class MjpegParser():
+    """ splits a chunked MJPEG byte stream into JPEG frames """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self._buf = bytearray()
+        self._max = max_frame_size
+
+    def feed(self, chunk, pool=None) -> list:
+        '''
+        adds a chunk of the stream and returns the list of frames it completed,
+        as bytes, or as PooledBuffer taken from `pool` if supplied.
+        '''
+        buf = self._buf
+        buf += chunk
+        frames = []
+        start = 0
+        while True:
+            soi = buf.find(SOI, start)
+            if soi < 0:
+                # keep a trailing 0xFF: it may be the first half of the next SOI
+                start = len(buf) - 1 if buf.endswith(b'\xff') else len(buf)
+                break
+            eoi = buf.find(EOI, soi + 2)
+            if eoi < 0:
+                start = soi
+                break
+            if pool is None:
+                frames.append(bytes(buf[soi:eoi + 2]))
+            else:
+                frame = pool.acquire(eoi + 2 - soi)
+                frame.write(memoryview(buf)[soi:eoi + 2])
+                frames.append(frame)
+            start = eoi + 2
+        del buf[:start]
+        if len(buf) > self._max:
+            buf.clear()
+        return frames
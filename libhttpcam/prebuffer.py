@@ -0,0 +1,176 @@
+#
+# Pre-event frame buffering.
+#
+# FrameRing keeps the most recent MJPEG frames of one camera in a single
+# preallocated bytearray, with frame offsets, lengths and timestamps held in
+# fixed-size arrays. Appending a frame copies it into the ring and evicts the
+# oldest frames it overwrites; no per-frame objects are kept alive.
+#
+# PreEventBuffer feeds a FrameRing from `HttpCam.async_mjpeg_frames` and, when
+# triggered by an alarm, dumps the pre-roll together with the following
+# post-roll frames to a directory or a callback.
+#
+
+import asyncio
+import os
+import time
+import logging
+from array import array
+
+_LOGGER = logging.getLogger(__name__)
+
+PRE_SECONDS = 5                 # default pre-roll
+MAX_BYTES = 16 * 1024 * 1024    # default ring storage
+MAX_FRAMES = 512                # default number of frame slots
+
+
+class FrameRing():
+    """ bounded ring of timestamped JPEG frames, limited by seconds, bytes and frame count """
+
+    def __init__(self, seconds=PRE_SECONDS, max_bytes=MAX_BYTES, max_frames=MAX_FRAMES):
+        self._seconds = seconds
+        self._data = bytearray(max_bytes)
+        self._offsets = array('q', bytes(8 * max_frames))
+        self._lengths = array('q', bytes(8 * max_frames))
+        self._stamps = array('d', bytes(8 * max_frames))
+        self._first = 0         # slot of the oldest frame
+        self._count = 0         # frames held
+        self._write = 0         # byte offset of the next write
+        self._nbytes = 0        # bytes held
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def duration(self) -> float:
+        ''' seconds between the oldest and the newest frame '''
+        if self._count == 0:
+            return 0.0
+        return self._stamps[self._slot(self._count - 1)] - self._stamps[self._first]
+
+    def _slot(self, i):
+        return (self._first + i) % len(self._stamps)
+
+    def _evict(self):
+        self._nbytes -= self._lengths[self._first]
+        self._first = (self._first + 1) % len(self._stamps)
+        self._count -= 1
+
+    def append(self, frame, stamp=None) -> bool:
+        ''' copies the frame into the ring. Returns False if the frame is larger than the ring. '''
+        size = len(frame)
+        capacity = len(self._data)
+        if size > capacity:
+            _LOGGER.warning('FrameRing: dropping %d byte frame, ring holds %d', size, capacity)
+            return False
+        stamp = time.time() if stamp is None else stamp
+
+        if self._count == 0:
+            self._write = 0
+        elif self._write + size > capacity:
+            # wrap: the frames between the write position and the end are the oldest
+            while self._count and self._offsets[self._first] >= self._write:
+                self._evict()
+            self._write = 0
+        end = self._write + size
+        while self._count and self._offsets[self._first] < end and \
+                self._offsets[self._first] + self._lengths[self._first] > self._write:
+            self._evict()
+        if self._count == len(self._stamps):
+            self._evict()
+        while self._count and self._stamps[self._first] < stamp - self._seconds:
+            self._evict()
+
+        self._data[self._write:end] = frame
+        slot = self._slot(self._count)
+        self._offsets[slot] = self._write
+        self._lengths[slot] = size
+        self._stamps[slot] = stamp
+        self._count += 1
+        self._nbytes += size
+        self._write = end
+        return True
+
+    def frames(self, since=None) -> list:
+        ''' returns a copy of the held frames, as a list of (timestamp, bytes), oldest first '''
+        result = []
+        for i in range(self._count):
+            slot = self._slot(i)
+            if since is not None and self._stamps[slot] < since:
+                continue
+            offset = self._offsets[slot]
+            result.append((self._stamps[slot], bytes(self._data[offset:offset + self._lengths[slot]])))
+        return result
+
+    def clear(self):
+        self._first = self._count = self._write = self._nbytes = 0
+
+
+class PreEventBuffer():
+    """
+    Keeps the last seconds of a camera's MJPEG stream and dumps them,
+    followed by a post-roll, when `trigger` is called:
+
+        buffer = PreEventBuffer(cam, seconds=5)
+        task = asyncio.ensure_future(buffer.run())
+        ...
+        frames = await buffer.trigger(post_seconds=10, path='/media/events/porch')
+    """
+
+    def __init__(self, cam, seconds=PRE_SECONDS, max_bytes=MAX_BYTES, max_frames=MAX_FRAMES):
+        self._cam = cam
+        self._ring = FrameRing(seconds, max_bytes, max_frames)
+        self._captures = []     # post-roll captures in progress: [until, frames, future]
+
+    @property
+    def ring(self) -> FrameRing:
+        return self._ring
+
+    async def run(self):
+        ''' consumes the camera's MJPEG stream until cancelled '''
+        async for frame in self._cam.async_mjpeg_frames():
+            self.add_frame(frame)
+
+    def add_frame(self, frame, stamp=None):
+        stamp = time.time() if stamp is None else stamp
+        self._ring.append(frame, stamp)
+        if self._captures:
+            for capture in list(self._captures):
+                if stamp <= capture[0]:
+                    capture[1].append((stamp, frame))
+                else:
+                    self._captures.remove(capture)
+                    capture[2].set_result(capture[1])
+
+    async def trigger(self, post_seconds=PRE_SECONDS, path=None, callback=None) -> list:
+        '''
+        captures the current pre-roll immediately, then collects post-roll frames
+        for `post_seconds`. The combined frames, a list of (timestamp, bytes), are
+        - written as `<timestamp>.jpg` files into the `path` directory, if supplied
+        - passed to `callback(frames)`, if supplied
+        - and returned.
+        '''
+        frames = self._ring.frames()
+        future = asyncio.get_running_loop().create_future()
+        self._captures.append([time.time() + post_seconds, frames, future])
+        try:
+            # complete the capture even if the stream stalls
+            frames = await asyncio.wait_for(asyncio.shield(future), post_seconds + 5)
+        except asyncio.TimeoutError:
+            self._captures = [c for c in self._captures if c[2] is not future]
+        if path is not None:
+            await asyncio.get_running_loop().run_in_executor(None, _write_frames, path, frames)
+        if callback is not None:
+            callback(frames)
+        return frames
+
+
+def _write_frames(path, frames):
+    os.makedirs(path, exist_ok=True)
+    for stamp, frame in frames:
+        with open(os.path.join(path, '%.3f.jpg' % stamp), 'wb') as f:
+            f.write(frame)
@@ -0,0 +1,67 @@
+#
+# Per-camera PTZ control.
+#
+# Motor and tour configuration is applied once and cached, moves are serialized,
+# and move requests that arrive while the camera is still busy are coalesced:
+# only the latest pending target is sent, and every caller waiting on a
+# superseded request receives the result of the move that replaced it.
+#
+
+import asyncio
+import logging
+from libhttpcam.httpcam import RESULT_CODE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PtzController():
+    """ serializes and coalesces the preset moves of one camera """
+
+    def __init__(self, cam):
+        self._cam = cam
+        self._configured = False
+        self._target = None
+        self._waiters = []
+        self._worker = None
+
+    @property
+    def configured(self) -> bool:
+        return self._configured
+
+    def invalidate(self):
+        ''' forces the motor configuration to be re-applied before the next move, e.g. after a reset '''
+        self._configured = False
+
+    async def goto(self, preset_pos):
+        ''' moves to `preset_pos`; returns the Response of the move that served this request '''
+        future = asyncio.get_running_loop().create_future()
+        self._target = preset_pos
+        self._waiters.append(future)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        return await future
+
+    async def _run(self):
+        while self._waiters:
+            target, waiters = self._target, self._waiters
+            self._target, self._waiters = None, []
+            if len(waiters) > 1:
+                _LOGGER.debug('ptz %s: coalesced %d moves to preset %s', self._cam.host, len(waiters), target)
+            try:
+                result = await self._move(target)
+            except Exception as e:
+                for future in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(result)
+
+    async def _move(self, target):
+        if not self._configured:
+            code, result = await self._cam._async_ptz_configure()
+            if code != RESULT_CODE['0']:
+                return (code, result)
+            self._configured = True
+        return await self._cam._async_ptz_goto(target)
@@ -0,0 +1,350 @@
+#
+# Push ingestion of camera uploads.
+#
+# Cameras configured with `async_set_ftp_config` upload alarm snapshots and
+# recordings as soon as an alarm fires. UploadReceiver runs a minimal FTP server
+# (passive mode, STOR) and an HTTP POST/PUT endpoint inside the event loop,
+# maps each upload to its HttpCam by source address, signals the alarm the
+# moment an upload starts, and streams the data to disk or memory in bounded
+# chunks.
+#
+#   receiver = UploadReceiver([cam1, cam2], directory='/media/uploads',
+#                             user='cam', password='secret', on_alarm=alarm)
+#   await receiver.start()
+#   await cam1.async_set_ftp_config(receiver_ip, receiver.ftp_port, 'cam', 'secret')
+#
+
+import asyncio
+import os
+import socket
+import time
+import logging
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+FTP_PORT = 2121
+HTTP_PORT = 8081
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD = 32 * 1024 * 1024       # bytes per upload
+DATA_TIMEOUT = 30                   # seconds to wait for an FTP data connection
+IDLE_TIMEOUT = 300                  # seconds of control connection inactivity
+
+Upload = namedtuple('Upload', ['cam', 'name', 'path', 'data', 'size', 'time'])
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class _UploadSink():
+    """ receives one upload into a file or into memory, bounded by `limit` bytes """
+
+    def __init__(self, cam, name, directory, limit):
+        self.cam = cam
+        self.name = name
+        self.time = time.time()
+        self.size = 0
+        self._limit = limit
+        self._data = None
+        self._file = None
+        self.path = None
+        if directory is None:
+            self._data = bytearray()
+        else:
+            folder = os.path.join(directory, cam.host)
+            os.makedirs(folder, exist_ok=True)
+            self.path = os.path.join(folder, '%d_%s' % (self.time * 1000, name))
+            self._file = open(self.path, 'wb')
+
+    async def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self._limit:
+            raise _TooLarge()
+        if self._file is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._file.write, chunk)
+        else:
+            self._data += chunk
+
+    def close(self, keep=True) -> Upload:
+        if self._file is not None:
+            self._file.close()
+            if not keep:
+                os.remove(self.path)
+        data = bytes(self._data) if self._data is not None else None
+        return Upload(self.cam, self.name, self.path, data, self.size, self.time)
+
+
+class UploadReceiver():
+    """ embedded FTP and HTTP receiver for camera uploads """
+
+    def __init__(self, cams, directory=None, user=None, password=None,
+                 on_alarm=None, on_upload=None, host='0.0.0.0',
+                 ftp_port=FTP_PORT, http_port=HTTP_PORT, max_upload=MAX_UPLOAD):
+        '''
+        - cams: the HttpCams expected to upload; uploads from other addresses are refused
+        - directory: store uploads in `<directory>/<cam host>/`; None keeps them in memory
+        - user, password: FTP credentials the cameras log in with; None accepts any
+        - on_alarm(cam, name): called when an upload starts
+        - on_upload(upload: Upload): called when an upload completed
+        - ftp_port, http_port: listening ports, None disables the server
+        '''
+        self._cams = list(cams)
+        self._by_addr = {}
+        self._directory = directory
+        self._user = user
+        self._password = password
+        self._on_alarm = on_alarm
+        self._on_upload = on_upload
+        self._host = host
+        self._max_upload = max_upload
+        self.ftp_port = ftp_port
+        self.http_port = http_port
+        self._servers = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for cam in self._cams:
+            for info in await loop.getaddrinfo(cam.host, None, type=socket.SOCK_STREAM):
+                self._by_addr[info[4][0]] = cam
+        if self.ftp_port is not None:
+            server = await asyncio.start_server(self._ftp_session, self._host, self.ftp_port)
+            self.ftp_port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        if self.http_port is not None:
+            server = await asyncio.start_server(self._http_session, self._host, self.http_port)
+            self.http_port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        _LOGGER.info('UploadReceiver listening: ftp %s, http %s', self.ftp_port, self.http_port)
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    def _cam_for(self, writer):
+        peer = writer.get_extra_info('peername')
+        return self._by_addr.get(peer[0]) if peer else None
+
+    def _open_sink(self, cam, name) -> _UploadSink:
+        name = os.path.basename(name.replace('\\', '/')) or 'upload'
+        cam.notify_alarm()
+        _dispatch(self._on_alarm, cam, name)
+        return _UploadSink(cam, name, self._directory, self._max_upload)
+
+    def _finish(self, sink, ok):
+        try:
+            upload = sink.close(keep=ok)
+        except OSError as e:
+            _LOGGER.error('upload from %s: %s', sink.cam.host, e)
+            return
+        if ok:
+            _LOGGER.debug('upload from %s: %s (%d bytes)', sink.cam.host, sink.name, sink.size)
+            _dispatch(self._on_upload, upload)
+
+    #
+    # ------------------
+    # FTP
+    #
+    async def _ftp_session(self, reader, writer):
+        cam = self._cam_for(writer)
+
+        def reply(line):
+            writer.write(('%s\r\n' % line).encode())
+
+        if cam is None:
+            reply('421 Unknown camera')
+            writer.close()
+            return
+        reply('220 libhttpcam upload receiver')
+        user = None
+        logged_in = False
+        cwd = '/'
+        passive = None      # (server, future of the data connection)
+        try:
+            while True:
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                if not line:
+                    break
+                cmd, _, arg = line.decode('latin-1').strip().partition(' ')
+                cmd = cmd.upper()
+                if cmd == 'USER':
+                    user = arg
+                    reply('331 Password required')
+                elif cmd == 'PASS':
+                    logged_in = self._user is None or (user == self._user and arg == self._password)
+                    reply('230 Logged in' if logged_in else '530 Login incorrect')
+                elif cmd == 'QUIT':
+                    reply('221 Bye')
+                    break
+                elif not logged_in:
+                    reply('530 Not logged in')
+                elif cmd in ('TYPE', 'MODE', 'STRU', 'NOOP', 'OPTS', 'ALLO'):
+                    reply('200 OK')
+                elif cmd == 'SYST':
+                    reply('215 UNIX Type: L8')
+                elif cmd == 'FEAT':
+                    reply('211 End')
+                elif cmd == 'PWD':
+                    reply('257 "%s"' % cwd)
+                elif cmd in ('CWD', 'CDUP'):
+                    cwd = '/' if cmd == 'CDUP' else os.path.normpath(os.path.join(cwd, arg))
+                    reply('250 OK')
+                elif cmd == 'MKD':
+                    reply('257 "%s" created' % arg)
+                elif cmd in ('DELE', 'RMD'):
+                    reply('250 OK')
+                elif cmd in ('PASV', 'EPSV'):
+                    if passive is not None:
+                        passive[0].close()
+                    passive = await self._open_passive(writer)
+                    port = passive[0].sockets[0].getsockname()[1]
+                    if cmd == 'EPSV':
+                        reply('229 Entering Extended Passive Mode (|||%d|)' % port)
+                    else:
+                        ip = writer.get_extra_info('sockname')[0].split('.')
+                        reply('227 Entering Passive Mode (%s,%d,%d)' % (','.join(ip), port >> 8, port & 0xff))
+                elif cmd in ('LIST', 'NLST'):
+                    data = await self._accept_data(passive, reply)
+                    passive = None
+                    if data is not None:
+                        data[1].close()
+                        reply('226 Transfer complete')
+                elif cmd in ('STOR', 'APPE', 'STOU'):
+                    data = await self._accept_data(passive, reply)
+                    passive = None
+                    if data is not None:
+                        await self._ftp_store(cam, arg, data, reply)
+                else:
+                    reply('502 Command not implemented')
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if passive is not None:
+                passive[0].close()
+            writer.close()
+
+    async def _open_passive(self, control):
+        connected = asyncio.get_running_loop().create_future()
+        camera = control.get_extra_info('peername')[0]
+
+        def on_connect(reader, writer):
+            peer = writer.get_extra_info('peername')
+            if connected.done() or not peer or peer[0] != camera:
+                # only the camera of the control connection may send its data
+                writer.close()
+            else:
+                connected.set_result((reader, writer))
+        host = control.get_extra_info('sockname')[0]
+        server = await asyncio.start_server(on_connect, host, 0)
+        return (server, connected)
+
+    async def _accept_data(self, passive, reply):
+        if passive is None:
+            reply('425 Use PASV first')
+            return None
+        server, connected = passive
+        try:
+            data = await asyncio.wait_for(connected, DATA_TIMEOUT)
+        except asyncio.TimeoutError:
+            reply('425 No data connection')
+            return None
+        finally:
+            server.close()
+        reply('150 Opening data connection')
+        return data
+
+    async def _ftp_store(self, cam, name, data, reply):
+        reader, writer = data
+        sink = None
+        ok = False
+        try:
+            sink = self._open_sink(cam, name or 'upload')
+            while True:
+                chunk = await asyncio.wait_for(reader.read(CHUNK_SIZE), DATA_TIMEOUT)
+                if not chunk:
+                    break
+                await sink.write(chunk)
+            ok = True
+            reply('226 Transfer complete')
+        except _TooLarge:
+            reply('552 Upload exceeds %d bytes' % self._max_upload)
+        except (ConnectionError, asyncio.TimeoutError):
+            reply('426 Connection closed; transfer aborted')
+        except OSError as e:
+            # disk full, permissions: the file could not be created or written
+            _LOGGER.error('upload from %s: %s', cam.host, e)
+            reply('451 Local error in processing')
+        finally:
+            writer.close()
+            if sink is not None:
+                self._finish(sink, ok)
+
+    #
+    # ------------------
+    # HTTP
+    #
+    async def _http_session(self, reader, writer):
+        cam = self._cam_for(writer)
+
+        def respond(status):
+            writer.write(('HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n' % status).encode())
+
+        try:
+            request = (await asyncio.wait_for(reader.readline(), DATA_TIMEOUT)).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), DATA_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if cam is None:
+                respond('403 Forbidden')
+            elif len(request) < 2 or request[0] not in ('POST', 'PUT'):
+                respond('405 Method Not Allowed')
+            elif 'content-length' not in headers:
+                respond('411 Length Required')
+            elif int(headers['content-length']) > self._max_upload:
+                respond('413 Payload Too Large')
+            else:
+                remaining = int(headers['content-length'])
+                sink = None
+                status = '400 Bad Request'
+                try:
+                    sink = self._open_sink(cam, request[1].split('?', 1)[0])
+                    while remaining:
+                        chunk = await asyncio.wait_for(reader.read(min(CHUNK_SIZE, remaining)), DATA_TIMEOUT)
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        await sink.write(chunk)
+                    if remaining == 0:
+                        status = '200 OK'
+                except ConnectionError:
+                    raise
+                except OSError as e:
+                    _LOGGER.error('upload from %s: %s', cam.host, e)
+                    status = '500 Internal Server Error'
+                finally:
+                    if sink is not None:
+                        self._finish(sink, status == '200 OK')
+                respond(status)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def _dispatch(callback, *args):
+    if callback is None:
+        return
+    try:
+        result = callback(*args)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+    except Exception:
+        _LOGGER.exception('UploadReceiver callback failed')
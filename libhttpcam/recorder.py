@@ -0,0 +1,225 @@
+#
+# Segmented MJPEG recording.
+#
+# Frames from `HttpCam.async_mjpeg_frames` are appended to fixed-duration segment
+# files, one directory per camera:
+#
+#   <directory>/<cam_id>/<segment start>.mjpeg   concatenated JPEG frames
+#   <directory>/<cam_id>/<segment start>.idx     fixed-width records (timestamp, offset, length)
+#
+# All disk I/O happens in one FileWriter thread, so recording many cameras never
+# blocks the event loop. Readers map both files with mmap and
+# binary-search the index, returning zero-copy memoryviews of the frames.
+#
+
+import asyncio
+import bisect
+import mmap
+import os
+import struct
+import time
+import logging
+from libhttpcam.filewriter import DataIndexFiles, FileWriter, QUEUE_SIZE, WRITE_BUFFER
+
+_LOGGER = logging.getLogger(__name__)
+
+SEGMENT_SECONDS = 60
+RETRY_SECONDS = 1               # first delay before reconnecting a failed stream
+RETRY_MAX_SECONDS = 60          # delays double up to this
+
+INDEX_RECORD = struct.Struct('<dQQ')    # timestamp, byte offset, length
+DATA_EXT = '.mjpeg'
+INDEX_EXT = '.idx'
+
+
+class _Segment(DataIndexFiles):
+    def __init__(self, path, start):
+        data = open(path + DATA_EXT, 'ab', buffering=WRITE_BUFFER)
+        try:
+            index = open(path + INDEX_EXT, 'ab', buffering=WRITE_BUFFER // 16)
+        except OSError:
+            data.close()
+            raise
+        super().__init__(data, index)
+        self.start = start
+        self.offset = data.tell()
+
+    def append(self, stamp, frame):
+        self.data.write(frame)
+        self.index.write(INDEX_RECORD.pack(stamp, self.offset, len(frame)))
+        self.offset += len(frame)
+
+
+class MjpegRecorder():
+    """
+    Records the MJPEG streams of many cameras into segment files.
+
+        recorder = MjpegRecorder('/media/recordings')
+        recorder.add('porch', cam)
+        ...
+        await recorder.close()
+    """
+
+    def __init__(self, directory, segment_seconds=SEGMENT_SECONDS, queue_size=QUEUE_SIZE):
+        self._directory = directory
+        self._segment_seconds = segment_seconds
+        self._tasks = {}
+        self._writer = FileWriter(self._write_frame, 'libhttpcam-recorder', queue_size)
+
+    @property
+    def dropped(self) -> int:
+        ''' frames dropped because the writer thread fell behind '''
+        return self._writer.dropped
+
+    def add(self, cam_id, cam):
+        ''' starts recording the camera's MJPEG stream '''
+        self._tasks[cam_id] = asyncio.ensure_future(self._record(cam_id, cam))
+
+    async def remove(self, cam_id):
+        task = self._tasks.pop(cam_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _record(self, cam_id, cam):
+        ''' records until removed, reconnecting with a growing delay when the stream fails or ends '''
+        delay = RETRY_SECONDS
+        while True:
+            try:
+                async for frame in cam.async_mjpeg_frames():
+                    self.write(cam_id, frame)
+                    delay = RETRY_SECONDS
+                _LOGGER.warning('recorder %s: stream ended, reconnecting in %gs', cam_id, delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _LOGGER.warning('recorder %s: %s, reconnecting in %gs', cam_id, e or type(e).__name__, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_SECONDS)
+
+    def write(self, cam_id, frame, stamp=None):
+        ''' queues a frame for recording '''
+        self._writer.put((cam_id, time.time() if stamp is None else stamp, frame))
+
+    async def close(self):
+        for cam_id in list(self._tasks):
+            await self.remove(cam_id)
+        await self._writer.close()
+
+    #
+    # ------------------
+    # Writer thread
+    #
+    def _write_frame(self, segments, item):
+        cam_id, stamp, frame = item
+        segment = segments.get(cam_id)
+        if segment is None or stamp >= segment.start + self._segment_seconds:
+            if segment is not None:
+                del segments[cam_id]
+                segment.close()
+            segment = segments[cam_id] = self._open_segment(cam_id, stamp)
+        segment.append(stamp, frame)
+
+    def _open_segment(self, cam_id, stamp):
+        path = os.path.join(self._directory, str(cam_id))
+        os.makedirs(path, exist_ok=True)
+        start = stamp - stamp % self._segment_seconds
+        return _Segment(os.path.join(path, '%d' % start), start)
+
+
+#
+# ------------------
+# Readers
+#
+class SegmentReader():
+    """ memory-mapped access to one recorded segment """
+
+    def __init__(self, path):
+        ''' path: segment file path without extension '''
+        self._data = _map(path + DATA_EXT)
+        self._index = _map(path + INDEX_EXT)
+        count = len(self._index) // INDEX_RECORD.size
+        # ignore a trailing record whose frame bytes are not on disk yet
+        while count and sum(self._record(count - 1)[1:]) > len(self._data):
+            count -= 1
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, i):
+        return INDEX_RECORD.unpack_from(self._index, i * INDEX_RECORD.size)
+
+    def timestamp(self, i) -> float:
+        return self._record(i)[0]
+
+    def frame(self, i) -> memoryview:
+        ''' zero-copy view of frame i; valid until the reader is closed '''
+        _, offset, length = self._record(i)
+        return memoryview(self._data)[offset:offset + length]
+
+    def find(self, stamp) -> int:
+        ''' index of the last frame at or before `stamp` (0 if `stamp` precedes the segment) '''
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) <= stamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
+    def close(self):
+        ''' unmaps the files; a map still exported by a frame memoryview is left to the garbage collector '''
+        for m in (self._data, self._index):
+            if isinstance(m, mmap.mmap):
+                try:
+                    m.close()
+                except BufferError:
+                    _LOGGER.debug('segment map still in use, not closed')
+
+
+class RecordingReader():
+    """ seeks across all segments of one camera's recording """
+
+    def __init__(self, directory, cam_id):
+        self._path = os.path.join(directory, str(cam_id))
+        names = [n[:-len(INDEX_EXT)] for n in os.listdir(self._path) if n.endswith(INDEX_EXT)]
+        self._starts = sorted(int(n) for n in names)
+        self._readers = {}
+
+    @property
+    def segments(self) -> list:
+        return list(self._starts)
+
+    def segment(self, start) -> SegmentReader:
+        reader = self._readers.get(start)
+        if reader is None:
+            reader = self._readers[start] = SegmentReader(os.path.join(self._path, '%d' % start))
+        return reader
+
+    def seek(self, stamp):
+        '''
+        returns (timestamp, memoryview) of the last recorded frame at or before
+        `stamp`, or None if nothing was recorded by then.
+        '''
+        idx = bisect.bisect_right(self._starts, stamp) - 1
+        while idx >= 0:
+            reader = self.segment(self._starts[idx])
+            if len(reader):
+                i = reader.find(stamp)
+                if reader.timestamp(i) <= stamp:
+                    return (reader.timestamp(i), reader.frame(i))
+            idx -= 1
+        return None
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
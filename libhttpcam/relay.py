@@ -0,0 +1,232 @@
+#
+# Caching HTTP relay for camera snapshots and streams.
+#
+#   python -m libhttpcam.relay --config cams.json [--host 0.0.0.0] [--port 8080]
+#
+# cams.json lists the cameras:
+#   [{"id": "porch", "brand": "foscam", "host": "10.0.0.30", "port": 88,
+#     "user": "me", "password": "secret"}, ...]
+#
+# Endpoints:
+#   GET /cam/<id>/snapshot   latest JPEG, cached for `snapshot_max_age` seconds,
+#                            with ETag / If-None-Match (304) support
+#   GET /cam/<id>/stream     multipart MJPEG, all viewers of a camera stream
+#                            share one upstream connection
+#
+# Both endpoints accept `?profile=preview` for the camera's reduced resolution
+# snapshot or stream (see HttpCam.async_get_profiles), defaulting to `full`.
+# Profiles resolving to the same stream URL share its upstream connection.
+# At most `max_upstream` snapshot requests per camera are in flight; the few
+# long-lived streams are not counted, so they never hold snapshots back.
+#
+# Camera credentials stay in the relay; clients never see camera URLs.
+#
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from aiohttp import web
+from libhttpcam.httpcam import createCam, RESULT_CODE, Profile
+
+_LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_MAX_AGE = 1.0      # seconds a snapshot is served from cache
+MAX_UPSTREAM = 2            # concurrent upstream snapshot requests per camera
+VIEWER_QUEUE = 2            # frames buffered per stream viewer; older frames are dropped
+BOUNDARY = 'libhttpcamframe'
+
+
+class _CamState():
+    """ relay state of one camera profile """
+
+    def __init__(self, cam_id, cam, upstream, profile):
+        self.cam_id = cam_id
+        self.cam = cam
+        self.upstream = upstream    # shared by the camera's profiles
+        self.profile = profile
+        self.snapshot = None        # (time, etag, jpeg)
+        self.pending = None         # in-flight snapshot fetch, shared by concurrent requests
+
+
+class _Stream():
+    """ one upstream stream and its viewers """
+
+    def __init__(self, cam, profile):
+        self.cam = cam
+        self.profile = profile      # the profile the camera resolved the request to
+        self.viewers = set()
+        self.task = None
+
+
+class CamRelay():
+    """ aiohttp application relaying snapshots and MJPEG streams of a set of cameras """
+
+    def __init__(self, cams: dict, snapshot_max_age=SNAPSHOT_MAX_AGE, max_upstream=MAX_UPSTREAM):
+        '''
+        - cams: dictionary of camera id -> HttpCam
+        - snapshot_max_age: seconds a snapshot is reused for repeated requests
+        - max_upstream: maximum concurrent snapshot requests to each camera
+        '''
+        self._cams = {}     # (cam id, Profile) -> _CamState
+        for cam_id, cam in cams.items():
+            upstream = asyncio.Semaphore(max_upstream)
+            for profile in Profile:
+                self._cams[(cam_id, profile)] = _CamState(cam_id, cam, upstream, profile)
+        self._streams = {}  # (cam id, stream URL) -> _Stream
+        self._max_age = snapshot_max_age
+        self.app = web.Application()
+        self.app.router.add_get('/cam/{id}/snapshot', self.handle_snapshot)
+        self.app.router.add_get('/cam/{id}/stream', self.handle_stream)
+        self.app.on_shutdown.append(self._on_shutdown)
+
+    def _state(self, request) -> _CamState:
+        try:
+            profile = Profile(request.query.get('profile', Profile.FULL.value))
+        except ValueError:
+            raise web.HTTPBadRequest(text='unknown profile')
+        state = self._cams.get((request.match_info['id'], profile))
+        if state is None:
+            raise web.HTTPNotFound()
+        return state
+
+    #
+    # ------------------
+    # Snapshots
+    #
+    async def handle_snapshot(self, request):
+        state = self._state(request)
+        snapshot = state.snapshot
+        if snapshot is None or time.monotonic() - snapshot[0] > self._max_age:
+            if state.pending is None:
+                state.pending = asyncio.ensure_future(self._fetch_snapshot(state))
+            try:
+                snapshot = await asyncio.shield(state.pending)
+            finally:
+                if state.pending is not None and state.pending.done():
+                    state.pending = None
+        if snapshot is None:
+            raise web.HTTPBadGateway(text='camera snapshot failed')
+        _, etag, jpeg = snapshot
+        headers = {'ETag': etag, 'Cache-Control': 'max-age=%d' % self._max_age}
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=jpeg, content_type='image/jpeg', headers=headers)
+
+    async def _fetch_snapshot(self, state):
+        async with state.upstream:
+            try:
+                code, jpeg = await state.cam.async_snap_picture(state.profile)
+            except Exception as e:
+                _LOGGER.warning('relay snapshot %s: %s', state.cam.host, e)
+                return None
+        if code != RESULT_CODE['0'] or not isinstance(jpeg, (bytes, bytearray)):
+            _LOGGER.warning('relay snapshot %s: %s', state.cam.host, code)
+            return None
+        etag = '"%s"' % hashlib.md5(jpeg).hexdigest()
+        if state.snapshot is not None and state.snapshot[1] == etag:
+            jpeg = state.snapshot[2]
+        state.snapshot = (time.monotonic(), etag, jpeg)
+        return state.snapshot
+
+    #
+    # ------------------
+    # Streams
+    #
+    async def _stream(self, state) -> _Stream:
+        ''' the stream serving the state's profile, shared by profiles with the same URL '''
+        profile = await state.cam._async_profile(state.profile, 'stream')
+        key = (state.cam_id, state.cam._getStreamURL(profile) or profile)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = _Stream(state.cam, profile)
+        return stream
+
+    async def handle_stream(self, request):
+        stream = await self._stream(self._state(request))
+        viewer = asyncio.Queue(VIEWER_QUEUE)
+        stream.viewers.add(viewer)
+        if stream.task is None:
+            stream.task = asyncio.ensure_future(self._pump(stream))
+        response = web.StreamResponse(headers={
+            'Content-Type': 'multipart/x-mixed-replace; boundary=%s' % BOUNDARY,
+            'Cache-Control': 'no-cache'})
+        try:
+            await response.prepare(request)
+            while True:
+                frame = await viewer.get()
+                if frame is None:
+                    break
+                await response.write(b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+                                     % (BOUNDARY.encode(), len(frame)))
+                await response.write(frame)
+                await response.write(b'\r\n')
+        except ConnectionResetError:
+            pass
+        finally:
+            stream.viewers.discard(viewer)
+            if not stream.viewers and stream.task is not None:
+                stream.task.cancel()
+                stream.task = None
+        return response
+
+    async def _pump(self, stream):
+        ''' reads one upstream stream and fans the frames out to all viewers '''
+        try:
+            async for frame in stream.cam.async_mjpeg_frames(stream.profile):
+                for viewer in stream.viewers:
+                    if viewer.full():
+                        viewer.get_nowait()
+                    viewer.put_nowait(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _LOGGER.warning('relay stream %s: %s', stream.cam.host, e)
+        finally:
+            # end the viewer responses, also when cancelled at shutdown; a pump cancelled
+            # after its last viewer left may already be replaced by a new one
+            if stream.task is asyncio.current_task():
+                stream.task = None
+                for viewer in stream.viewers:
+                    if viewer.full():
+                        viewer.get_nowait()
+                    viewer.put_nowait(None)
+
+    async def _on_shutdown(self, app):
+        for stream in self._streams.values():
+            if stream.task is not None:
+                stream.task.cancel()
+        for cam in {state.cam for state in self._cams.values()}:
+            await cam._session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m libhttpcam.relay',
+                                     description='Caching HTTP relay for camera snapshots and streams')
+    parser.add_argument('--config', required=True, help='JSON file listing the cameras')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-age', type=float, default=SNAPSHOT_MAX_AGE, help='snapshot cache seconds')
+    parser.add_argument('--max-upstream', type=int, default=MAX_UPSTREAM,
+                        help='concurrent snapshot requests per camera')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    async def make_app():
+        cams = {}
+        for c in config:
+            cam, _ = createCam(c['brand'], c['host'], c.get('port'))
+            cam.set_credentials(c.get('user', ''), c.get('password', ''))
+            cams[str(c['id'])] = cam
+        return CamRelay(cams, args.max_age, args.max_upstream).app
+
+    web.run_app(make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#
+# Typed CGI results.
+#
+# A result object keeps the raw string values of one command's response in a
+# single tuple, ordered by the class's `_fields`, and decodes a field only when
+# it is accessed. With __slots__ and no per-instance dict, retaining the last
+# result of many cameras costs one tuple each.
+#
+
+from libhttpcam.httpcam import Trigger, Action
+
+
+def _int(s):
+    return int(s)
+
+
+def _bool(s):
+    return s == '1'
+
+
+def _onoff(s):
+    return s == 'on'
+
+
+def _str(s):
+    return s
+
+
+class Field():
+    """ descriptor decoding one raw value of a CgiResult on access """
+
+    def __init__(self, decode=_str):
+        self.decode = decode
+        self.index = None
+        self.name = None
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        raw = obj._values[self.index]
+        return None if raw is None else self.decode(raw)
+
+
+class _ResultMeta(type):
+    def __new__(mcs, name, bases, ns):
+        fields = []
+        for base in bases:
+            fields.extend(getattr(base, '_fields', ()))
+        for key, value in list(ns.items()):
+            if isinstance(value, Field):
+                value.index = len(fields)
+                value.name = key
+                fields.append(key)
+        ns['_fields'] = tuple(fields)
+        ns.setdefault('__slots__', ())
+        return super(_ResultMeta, mcs).__new__(mcs, name, bases, ns)
+
+
+class CgiResult(metaclass=_ResultMeta):
+    """ base of the typed command results """
+    __slots__ = ('_values',)
+
+    def __init__(self, values: tuple):
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        ''' keeps the values of the class's fields from a `_parseResult` dictionary '''
+        return cls(tuple(d.get(f) for f in cls._fields))
+
+    def as_dict(self) -> dict:
+        ''' the decoded fields as a dictionary '''
+        return {f: getattr(self, f) for f in self._fields}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values == other._values
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % kv for kv in self.as_dict().items()))
+
+
+#
+# ------------------
+# Foscam
+#
+FOSCAM_LINK_AUDIO = 1
+FOSCAM_LINK_MAIL = 2
+FOSCAM_LINK_PIC = 4
+FOSCAM_LINK_VIDEO = 8
+
+
+class FoscamMotionDetectConfig(CgiResult):
+    ''' getMotionDetectConfig '''
+    isEnable = Field(_bool)
+    linkage = Field(_int)
+    snapInterval = Field(_int)
+    sensitivity = Field(_int)
+    triggerInterval = Field(_int)
+    isMovAlarmEnable = Field(_bool)
+    isPirAlarmEnable = Field(_bool)
+    schedule0 = Field(_int)
+    schedule1 = Field(_int)
+    schedule2 = Field(_int)
+    schedule3 = Field(_int)
+    schedule4 = Field(_int)
+    schedule5 = Field(_int)
+    schedule6 = Field(_int)
+    area0 = Field(_int)
+    area1 = Field(_int)
+    area2 = Field(_int)
+    area3 = Field(_int)
+    area4 = Field(_int)
+    area5 = Field(_int)
+    area6 = Field(_int)
+    area7 = Field(_int)
+    area8 = Field(_int)
+    area9 = Field(_int)
+
+    @property
+    def schedule(self) -> tuple:
+        ''' per weekday bitmask of the armed half-hours '''
+        return tuple(getattr(self, 'schedule%d' % i) for i in range(7))
+
+    @property
+    def area(self) -> tuple:
+        ''' per row bitmask of the detection area '''
+        return tuple(getattr(self, 'area%d' % i) for i in range(10))
+
+    @property
+    def trigger(self) -> Trigger:
+        return Trigger(motion=bool(self.isEnable), audio=False)
+
+    @property
+    def action(self) -> Action:
+        link = self.linkage or 0
+        return Action(
+            audio=bool(link & FOSCAM_LINK_AUDIO),
+            ftp_snap=bool(link & FOSCAM_LINK_PIC),
+            ftp_rec=bool(link & FOSCAM_LINK_VIDEO)
+        )
+
+
+#
+# ------------------
+# Wansview
+#
+class WansviewAlarmTrigger(CgiResult):
+    ''' alarm.cgi getmdattr + getaudioalarmattr (detection area 0) '''
+    enable_0 = Field(_bool)
+    sensitivity_0 = Field(_int)
+    aa_enable = Field(_bool)
+    aa_value = Field(_int)
+
+    @property
+    def trigger(self) -> Trigger:
+        return Trigger(motion=bool(self.enable_0), audio=bool(self.aa_enable))
+
+
+class WansviewAlarmAction(CgiResult):
+    ''' alarm.cgi getalarmact ... '''
+    act_ftpsnap_switch = Field(_onoff)
+    act_ftprec_switch = Field(_onoff)
+    act_alarm_type = Field(_onoff)
+    act_emailsnap_switch = Field(_onoff)
+    act_snap_switch = Field(_onoff)
+    act_record_switch = Field(_onoff)
+    act_relay_switch = Field(_onoff)
+    act_preset_switch = Field(_onoff)
+    act_alarmbeep_switch = Field(_onoff)
+    audiotime = Field(_int)
+
+    @property
+    def action(self) -> Action:
+        return Action(
+            audio=bool(self.act_alarmbeep_switch),
+            ftp_snap=bool(self.act_ftpsnap_switch),
+            ftp_rec=bool(self.act_ftprec_switch)
+        )
+
+
+class WansviewInfrared(CgiResult):
+    ''' irctrl.cgi getinfrared, getirparams, getircutctrl, getircuttime, getircutstatus '''
+    infraredstatus = Field()
+    irparams = Field(_int)
+    ircutctrlstatus = Field()
+    starttime = Field()
+    endtime = Field()
+    ircutstatus = Field()
@@ -0,0 +1,171 @@
+#
+# Per-camera request scheduling.
+#
+# The cameras' embedded web servers fail when they receive more than a couple
+# of concurrent requests. Each camera host therefore gets one HostScheduler that
+# caps the requests in flight and grants free slots by priority class, FIFO
+# within a class, so a snapshot never waits behind a queue of config polls.
+#
+# A host's scheduler is shared by every camera object of the process, including
+# cameras on other event loops (e.g. a SyncCam loop thread next to the app's
+# loop). Its state is guarded by a lock, and a slot freed on one loop is granted
+# to a waiter on another through that loop's call_soon_threadsafe.
+#
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from enum import IntEnum
+
+DEFAULT_CONCURRENCY = 2
+
+
+class Priority(IntEnum):
+    STREAM = 0      # streams and snapshots
+    ALARM = 1       # alarm state
+    READ = 2        # configuration reads
+    WRITE = 3       # configuration writes
+
+
+class _Slot():
+    def __init__(self, scheduler, priority):
+        self._scheduler = scheduler
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._scheduler.acquire(self._priority)
+
+    async def __aexit__(self, *args):
+        self._scheduler.release()
+
+
+class HostScheduler():
+    """ concurrency-limited priority queue for the requests to one camera host """
+
+    def __init__(self, limit=DEFAULT_CONCURRENCY):
+        self._limit = limit
+        self._active = 0
+        self._queue = []        # heap of (priority, sequence, future)
+        self._waiting = set()   # futures in the queue that were not granted yet
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._depth = [0] * len(Priority)
+        self._count = [0] * len(Priority)
+        self._wait_total = [0.0] * len(Priority)
+        self._wait_max = [0.0] * len(Priority)
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        with self._lock:
+            self._limit = max(1, int(limit))
+            self._wake()
+
+    def slot(self, priority: Priority) -> _Slot:
+        ''' `async with scheduler.slot(Priority.READ):` holds one request slot '''
+        return _Slot(self, priority)
+
+    async def acquire(self, priority: Priority):
+        with self._lock:
+            if self._active < self._limit and not self._queue:
+                self._active += 1
+                self._record(priority, 0.0)
+                return
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (priority, next(self._seq), future))
+            self._waiting.add(future)
+            self._depth[priority] += 1
+            self._wake()
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiting:
+                    # still queued: the entry is skipped when it reaches the head
+                    self._waiting.discard(future)
+                    self._depth[priority] -= 1
+                    return_slot = False
+                else:
+                    # granted, but the caller went away; a grant still on its way
+                    # from another loop returns the slot itself in _grant
+                    return_slot = not future.cancelled()
+            if return_slot:
+                self.release()
+            raise
+        with self._lock:
+            self._record(priority, time.monotonic() - start)
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self._wake()
+
+    def _wake(self):
+        ''' grants free slots to the queue head; called with the lock held '''
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        while self._active < self._limit and self._queue:
+            priority, _, future = heapq.heappop(self._queue)
+            if future not in self._waiting or future.done():
+                continue
+            self._waiting.discard(future)
+            self._depth[priority] -= 1
+            self._active += 1
+            loop = future.get_loop()
+            if loop is running:
+                future.set_result(None)
+            else:
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                except RuntimeError:    # the waiter's loop is closed
+                    self._active -= 1
+
+    def _grant(self, future):
+        ''' resolves a waiter's future on its own loop '''
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _record(self, priority, wait):
+        self._count[priority] += 1
+        self._wait_total[priority] += wait
+        if wait > self._wait_max[priority]:
+            self._wait_max[priority] = wait
+
+    def stats(self) -> dict:
+        '''
+        returns the scheduler metrics:
+        - active: requests in flight
+        - limit: concurrency cap
+        - per priority class name: queue depth, granted request count, mean and max wait in seconds
+        '''
+        result = {'active': self._active, 'limit': self._limit}
+        for p in Priority:
+            count = self._count[p]
+            result[p.name.lower()] = {
+                'depth': self._depth[p],
+                'count': count,
+                'wait_mean': self._wait_total[p] / count if count else 0.0,
+                'wait_max': self._wait_max[p],
+            }
+        return result
+
+
+_schedulers = {}
+
+
+def scheduler_for(host) -> HostScheduler:
+    ''' returns the shared scheduler of a camera host, creating it on first use '''
+    scheduler = _schedulers.get(host)
+    if scheduler is None:
+        scheduler = _schedulers[host] = HostScheduler()
+    return scheduler
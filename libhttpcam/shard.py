@@ -0,0 +1,311 @@
+#
+# Multi-process fleet sharding.
+#
+# A single event loop runs out of CPU (result parsing, digest hashing, JPEG
+# handling) at a few hundred active cameras. ShardedFleet spreads the cameras
+# over N worker processes, each with its own event loop and one pooled session.
+# Cameras are assigned to workers by consistent hashing on the host, so a dying
+# worker only moves its own cameras.
+#
+# Commands and small results travel pickled over a multiprocessing Pipe. Large
+# binary results (snapshots) are sent raw with send_bytes after a small header,
+# so the image bytes are copied into the pipe once and never pickled.
+#
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+from libhttpcam.httpcam import createCam, HttpCamError
+
+_LOGGER = logging.getLogger(__name__)
+
+RING_REPLICAS = 64          # virtual nodes per worker on the hash ring
+RAW_THRESHOLD = 16 * 1024   # binary results from this size on bypass pickling
+
+
+class HashRing():
+    """ consistent hash ring mapping keys (camera hosts) to nodes (workers) """
+
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self._replicas = replicas
+        self._keys = []
+        self._nodes = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def add(self, node):
+        for i in range(self._replicas):
+            h = self._hash('%s#%d' % (node, i))
+            idx = bisect.bisect(self._keys, h)
+            self._keys.insert(idx, h)
+            self._nodes.insert(idx, node)
+
+    def remove(self, node):
+        keep = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def get(self, key):
+        if not self._keys:
+            raise HttpCamError('no workers available')
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[idx]
+
+
+#
+# ------------------
+# Worker process
+#
+def _worker_main(conn, session_factory, raw_threshold):
+    asyncio.run(_Worker(conn, session_factory, raw_threshold).run())
+
+
+class _Worker():
+    """ runs in the worker process: owns the cameras of one shard """
+
+    def __init__(self, conn, session_factory, raw_threshold):
+        self._conn = conn
+        self._session_factory = session_factory
+        self._raw_threshold = raw_threshold
+        self._cams = {}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._session = self._session_factory() if self._session_factory else None
+        self._done = loop.create_future()
+        loop.add_reader(self._conn.fileno(), self._on_message)
+        await self._done
+        loop.remove_reader(self._conn.fileno())
+        sessions = {id(cam._session): cam._session for cam in self._cams.values()}
+        if self._session is not None:
+            sessions[id(self._session)] = self._session
+        for session in sessions.values():
+            await session.close()
+
+    def _on_message(self):
+        try:
+            msg = self._conn.recv()
+        except (EOFError, OSError):
+            msg = ('stop',)
+        op = msg[0]
+        if op == 'add':
+            _, cam_id, brand, host, port, user, password = msg
+            cam, _ = createCam(brand, host, port, self._session)
+            cam.set_credentials(user, password)
+            self._cams[cam_id] = cam
+        elif op == 'remove':
+            cam = self._cams.pop(msg[1], None)
+            if cam is not None and self._session is None:
+                asyncio.ensure_future(cam._session.close())
+        elif op == 'call':
+            asyncio.ensure_future(self._call(*msg[1:]))
+        elif op == 'stop' and not self._done.done():
+            self._done.set_result(None)
+
+    async def _call(self, req_id, cam_id, method, args, kwargs):
+        try:
+            result = await getattr(self._cams[cam_id], 'async_' + method)(*args, **kwargs)
+        except Exception as e:
+            self._conn.send(('err', req_id, '%s: %s' % (type(e).__name__, e)))
+            return
+        if (isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], (bytes, bytearray))
+                and len(result[1]) >= self._raw_threshold):
+            self._conn.send(('raw', req_id, result[0]))
+            self._conn.send_bytes(result[1])
+        else:
+            self._conn.send(('ok', req_id, result))
+
+
+#
+# ------------------
+# Coordinator
+#
+class _WorkerHandle():
+    def __init__(self, name, process, conn):
+        self.name = name
+        self.process = process
+        self.conn = conn
+        self.cams = set()
+
+
+class ShardedFleet():
+    """
+    Coordinator for cameras sharded over worker processes. Must be used from
+    within a running asyncio event loop on a platform that supports
+    `loop.add_reader` for pipes.
+
+        fleet = ShardedFleet(workers=4)
+        await fleet.start()
+        fleet.add('porch', 'foscam', '10.0.0.30', user='me', password='secret')
+        code, jpeg = await fleet.call('porch', 'snap_picture')
+    """
+
+    def __init__(self, workers=None, session_factory=None, respawn=True,
+                 raw_threshold=RAW_THRESHOLD, mp_context='spawn'):
+        '''
+        - workers: number of worker processes, default os.cpu_count()
+        - session_factory: picklable callable creating the per-worker session,
+          e.g. `LeanSession`; default is one aiohttp session per camera
+        - respawn: replace dead workers with fresh processes
+        '''
+        self._count = workers or multiprocessing.cpu_count()
+        self._session_factory = session_factory
+        self._respawn = respawn
+        self._raw_threshold = raw_threshold
+        self._ctx = multiprocessing.get_context(mp_context)
+        self._ring = HashRing()
+        self._workers = {}      # name -> _WorkerHandle
+        self._specs = {}        # cam_id -> (brand, host, port, user, password)
+        self._location = {}     # cam_id -> worker name
+        self._pending = {}      # req_id -> (future, worker name)
+        self._req_ids = itertools.count()
+        self._names = itertools.count()
+        self._loop = None
+        self._closing = False
+
+    @property
+    def workers(self) -> list:
+        return list(self._workers)
+
+    def worker_of(self, cam_id) -> str:
+        return self._location[cam_id]
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for _ in range(self._count):
+            self._spawn()
+
+    def _spawn(self, name=None) -> _WorkerHandle:
+        ''' starts a worker; `name` reuses a dead worker's ring positions '''
+        if name is None:
+            name = 'worker-%d' % next(self._names)
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, name=name, daemon=True,
+                                    args=(child, self._session_factory, self._raw_threshold))
+        process.start()
+        child.close()
+        handle = _WorkerHandle(name, process, parent)
+        self._workers[name] = handle
+        self._ring.add(name)
+        self._loop.add_reader(parent.fileno(), self._on_message, handle)
+        _LOGGER.info('ShardedFleet started %s (pid %s)', name, process.pid)
+        return handle
+
+    #
+    # ------------------
+    # Camera registry
+    #
+    def add(self, cam_id, brand, host, port=None, user='', password=''):
+        self._specs[cam_id] = (brand, host, port, user, password)
+        self._place(cam_id, self._ring.get(host))
+
+    def remove(self, cam_id):
+        self._specs.pop(cam_id)
+        handle = self._workers.get(self._location.pop(cam_id))
+        if handle is not None:
+            handle.cams.discard(cam_id)
+            self._send(handle, ('remove', cam_id))
+
+    def _place(self, cam_id, name):
+        handle = self._workers[name]
+        handle.cams.add(cam_id)
+        self._location[cam_id] = name
+        self._send(handle, ('add', cam_id) + self._specs[cam_id])
+
+    def _rebalance(self):
+        ''' places every camera whose ring position no longer maps to a worker holding it '''
+        for cam_id, spec in self._specs.items():
+            target = self._ring.get(spec[1])
+            current = self._location.get(cam_id)
+            held = current in self._workers and cam_id in self._workers[current].cams
+            if target == current and held:
+                continue
+            if held:
+                self._workers[current].cams.discard(cam_id)
+                self._send(self._workers[current], ('remove', cam_id))
+            self._place(cam_id, target)
+
+    #
+    # ------------------
+    # Commands
+    #
+    async def call(self, cam_id, method, *args, **kwargs):
+        ''' runs `async_<method>(*args, **kwargs)` for the camera in its worker and returns the result '''
+        name = self._location[cam_id]
+        req_id = next(self._req_ids)
+        future = self._loop.create_future()
+        self._pending[req_id] = (future, name)
+        self._send(self._workers[name], ('call', req_id, cam_id, method, args, kwargs))
+        return await future
+
+    async def gather(self, method, *args, **kwargs) -> dict:
+        '''
+        runs the command on all cameras concurrently.
+        returns a dictionary of camera id -> result; failed calls return their exception.
+        '''
+        ids = list(self._specs)
+        results = await asyncio.gather(*[self.call(i, method, *args, **kwargs) for i in ids],
+                                       return_exceptions=True)
+        return dict(zip(ids, results))
+
+    def _send(self, handle, msg):
+        try:
+            handle.conn.send(msg)
+        except (BrokenPipeError, OSError):
+            self._worker_died(handle)
+
+    def _on_message(self, handle):
+        try:
+            msg = handle.conn.recv()
+            if msg[0] == 'raw':
+                msg = ('ok', msg[1], (msg[2], handle.conn.recv_bytes()))
+        except (EOFError, OSError):
+            self._worker_died(handle)
+            return
+        status, req_id, value = msg
+        future, _ = self._pending.pop(req_id, (None, None))
+        if future is None or future.done():
+            return
+        if status == 'ok':
+            future.set_result(value)
+        else:
+            future.set_exception(HttpCamError(value))
+
+    def _worker_died(self, handle):
+        if handle.name not in self._workers:
+            return
+        del self._workers[handle.name]
+        self._loop.remove_reader(handle.conn.fileno())
+        handle.conn.close()
+        self._ring.remove(handle.name)
+        for req_id, (future, name) in list(self._pending.items()):
+            if name == handle.name:
+                del self._pending[req_id]
+                if not future.done():
+                    future.set_exception(HttpCamError('%s exited' % handle.name))
+        if self._closing:
+            return
+        _LOGGER.warning('ShardedFleet %s died (exit code %s), rebalancing %d cameras',
+                        handle.name, handle.process.exitcode, len(handle.cams))
+        if self._respawn:
+            # same name, same ring positions: only the dead worker's cameras are placed again
+            self._spawn(handle.name)
+        if self._workers:
+            self._rebalance()
+
+    async def close(self):
+        self._closing = True
+        for handle in list(self._workers.values()):
+            self._send(handle, ('stop',))
+        for handle in list(self._workers.values()):
+            await self._loop.run_in_executor(None, handle.process.join, 5)
+            if handle.process.is_alive():
+                handle.process.terminate()
+            self._worker_died(handle)
@@ -0,0 +1,189 @@
+#
+# Blocking facade for threaded, synchronous callers.
+#
+# All cameras live on one long-lived event loop running in a background thread.
+# Calls are submitted with asyncio.run_coroutine_threadsafe, so HTTP sessions and
+# their pooled keep-alive connections survive across calls, instead of being
+# rebound to a fresh loop by every asyncio.run().
+#
+
+import asyncio
+import concurrent.futures
+import threading
+import logging
+from libhttpcam.httpcam import createCam, HttpCamError
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30        # seconds to wait for a blocking call
+
+_default_loop = None
+_default_lock = threading.Lock()
+
+
+class LoopThread():
+    """ an asyncio event loop running forever in a daemon thread """
+
+    def __init__(self, name='libhttpcam-loop'):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        self._loop.close()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def run(self, coro, timeout=DEFAULT_TIMEOUT):
+        '''
+        runs the coroutine on the loop thread and blocks until it completes.
+        Must not be called from the loop thread itself.
+        On timeout, the coroutine is cancelled before the TimeoutError is raised.
+        '''
+        if threading.current_thread() is self._thread:
+            raise HttpCamError('blocking call made from inside the event loop thread')
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def submit(self, coro):
+        ''' schedules the coroutine on the loop thread and returns a concurrent.futures.Future '''
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self):
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def default_loop() -> LoopThread:
+    ''' returns the process-wide loop thread, starting it on first use '''
+    global _default_loop
+    with _default_lock:
+        if _default_loop is None:
+            _default_loop = LoopThread()
+        return _default_loop
+
+
+class SyncCam():
+    """
+    Blocking wrapper around an HttpCam. Every `async_<name>` coroutine of the camera
+    is available as a blocking `<name>` method, e.g. `snap_picture()` or `set_irled(status)`.
+    """
+
+    def __init__(self, brand, ip, port=None, user='', password='', session=None, loop=None, timeout=DEFAULT_TIMEOUT):
+        self._loop = loop if loop is not None else default_loop()
+        self._timeout = timeout
+
+        async def create():
+            # create the camera on the loop thread so its session binds to that loop
+            cam, _ = createCam(brand, ip, port, session)
+            cam.set_credentials(user, password)
+            return cam
+        self._cam = self._loop.run(create(), timeout)
+
+    @property
+    def cam(self):
+        ''' the wrapped HttpCam; only use its coroutines on `loop` '''
+        return self._cam
+
+    @property
+    def loop(self) -> LoopThread:
+        return self._loop
+
+    @property
+    def brand(self):
+        return self._cam.brand
+
+    @property
+    def model(self):
+        return self._cam.model
+
+    @property
+    def host(self):
+        return self._cam.host
+
+    @property
+    def port(self):
+        return self._cam.port
+
+    def set_credentials(self, user='', password=''):
+        async def apply():
+            self._cam.set_credentials(user, password)
+        self._loop.run(apply(), self._timeout)
+
+    def set_sensitivities(self, motion=0, audio=0):
+        self._cam.set_sensitivities(motion, audio)
+
+    def call(self, name, *args, **kwargs):
+        ''' blocking call of the camera coroutine `async_<name>` '''
+        return self._loop.run(getattr(self._cam, 'async_' + name)(*args, **kwargs), self._timeout)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not hasattr(self._cam, 'async_' + name):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+    def close(self):
+        ''' closes the camera's HTTP session '''
+        session = self._cam._session
+        if session is not None and not session.closed:
+            self._loop.run(session.close(), self._timeout)
+
+
+class SyncFleet():
+    """
+    A set of SyncCams sharing one loop thread. `call` runs the same command on
+    every camera concurrently and blocks until all have answered.
+    """
+
+    def __init__(self, loop=None, timeout=DEFAULT_TIMEOUT):
+        self._loop = loop if loop is not None else default_loop()
+        self._timeout = timeout
+        self._cams = {}
+
+    def add(self, name, brand, ip, port=None, user='', password='', session=None) -> SyncCam:
+        cam = SyncCam(brand, ip, port, user, password, session, self._loop, self._timeout)
+        self._cams[name] = cam
+        return cam
+
+    def remove(self, name):
+        self._cams.pop(name).close()
+
+    def __getitem__(self, name) -> SyncCam:
+        return self._cams[name]
+
+    def __iter__(self):
+        return iter(self._cams)
+
+    def __len__(self):
+        return len(self._cams)
+
+    def call(self, name, *args, **kwargs) -> dict:
+        '''
+        runs `async_<name>(*args, **kwargs)` on all cameras concurrently.
+        returns a dictionary of camera name -> result; failed calls return their exception.
+        '''
+        names = list(self._cams)
+
+        async def gather():
+            return await asyncio.gather(
+                *[getattr(self._cams[n].cam, 'async_' + name)(*args, **kwargs) for n in names],
+                return_exceptions=True)
+        return dict(zip(names, self._loop.run(gather(), self._timeout)))
+
+    def close(self):
+        for cam in self._cams.values():
+            cam.close()
+        self._cams = {}
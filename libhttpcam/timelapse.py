@@ -0,0 +1,307 @@
+#
+# Time-aligned timelapse capture.
+#
+# Timelapse snaps all its cameras at the same wall-clock ticks, multiples of
+# `interval` seconds since the epoch. Ticks are computed from that grid rather
+# than from sleep durations, so they never drift. A camera still busy with the
+# previous tick skips the tick; a failed or timed-out snapshot is recorded as
+# failed. Ticks missed entirely, e.g. while the host was suspended, are recorded
+# as skipped for all cameras.
+#
+# Frames are appended to one archive per camera and UTC day:
+#
+#   <directory>/<cam_id>/<YYYYMMDD>_<interval>.mjpeg   concatenated JPEG frames
+#   <directory>/<cam_id>/<YYYYMMDD>_<interval>.tlx     header, then one fixed-width record per tick
+#
+# A tick's record sits at a position computed from its time, so looking up the
+# frame of any moment takes two reads. Records of ticks without a capture are
+# zero (MISSING). Disk I/O happens in one FileWriter thread.
+#
+
+import asyncio
+import os
+import struct
+import time
+import logging
+from libhttpcam.httpcam import RESULT_CODE, Profile
+from libhttpcam.filewriter import DataIndexFiles, FileWriter, QUEUE_SIZE, WRITE_BUFFER
+
+_LOGGER = logging.getLogger(__name__)
+
+INTERVAL = 60                   # seconds between ticks
+TIMEOUT_FRACTION = 0.9          # default snapshot timeout, as a fraction of the interval
+DAY = 86400
+
+HEADER = struct.Struct('<4sdd')         # magic, day start, interval
+TICK_RECORD = struct.Struct('<dQII')    # capture time, byte offset, length, status
+MAGIC = b'TLX1'
+DATA_EXT = '.mjpeg'
+INDEX_EXT = '.tlx'
+
+# tick record status
+MISSING = 0     # no record: the timelapse was not running
+FRAME = 1       # frame captured
+SKIPPED = 2     # camera still busy with the previous tick, or tick missed entirely
+FAILED = 3      # snapshot failed or timed out
+
+
+def day_start(stamp) -> float:
+    ''' start of the UTC day containing `stamp` '''
+    return stamp - stamp % DAY
+
+
+def archive_path(directory, cam_id, stamp, interval) -> str:
+    ''' path of the camera's archive for the day of `stamp`, without extension '''
+    day = time.strftime('%Y%m%d', time.gmtime(stamp))
+    return os.path.join(directory, str(cam_id), '%s_%g' % (day, interval))
+
+
+class _DayArchive(DataIndexFiles):
+    """ the data and index files of one camera and day, written by the writer thread """
+
+    def __init__(self, path, start, interval):
+        data = open(path + DATA_EXT, 'ab', buffering=WRITE_BUFFER)
+        try:
+            exists = os.path.exists(path + INDEX_EXT)
+            index = open(path + INDEX_EXT, 'r+b' if exists else 'w+b', buffering=WRITE_BUFFER // 16)
+            if not exists:
+                index.write(HEADER.pack(MAGIC, start, interval))
+        except OSError:
+            data.close()
+            raise
+        super().__init__(data, index)
+        self.start = start
+        self.interval = interval
+        self.offset = data.tell()
+
+    def put(self, tick, stamp, status, frame):
+        length = 0
+        if frame is not None:
+            self.data.write(frame)
+            length = len(frame)
+        slot = int((tick - self.start) // self.interval)
+        self.index.seek(HEADER.size + slot * TICK_RECORD.size)
+        self.index.write(TICK_RECORD.pack(stamp, self.offset, length, status))
+        self.offset += length
+
+
+class Timelapse():
+    """
+    Snaps many cameras at aligned wall-clock ticks into per-day archives.
+
+        timelapse = Timelapse('/media/timelapse', interval=60)
+        timelapse.add('porch', cam1)
+        timelapse.add('garage', cam2)
+        task = asyncio.ensure_future(timelapse.run())
+        ...
+        await timelapse.close()
+    """
+
+    def __init__(self, directory, interval=INTERVAL, timeout=None, profile=Profile.FULL,
+                 queue_size=QUEUE_SIZE):
+        '''
+        - interval: seconds between ticks; ticks are multiples of `interval` since the epoch
+        - timeout: seconds a snapshot may take, defaults to 0.9 * interval
+        - profile: snapshot Profile, e.g. Profile.PREVIEW for thumbnails
+        '''
+        self._directory = directory
+        self._interval = interval
+        self._timeout = interval * TIMEOUT_FRACTION if timeout is None else timeout
+        self._profile = profile
+        self._cams = {}
+        self._pending = {}      # cam_id -> capture task of the camera's last tick
+        self._stats = {}        # cam_id -> {status name: count}
+        self._runner = None
+        self._writer = FileWriter(self._write_record, 'libhttpcam-timelapse', queue_size)
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def dropped(self) -> int:
+        ''' records dropped because the writer thread fell behind '''
+        return self._writer.dropped
+
+    def add(self, cam_id, cam):
+        ''' adds a camera, captured from the next tick on '''
+        self._cams[cam_id] = cam
+        self._stats.setdefault(cam_id, {'frames': 0, 'skipped': 0, 'failed': 0})
+
+    def remove(self, cam_id):
+        self._cams.pop(cam_id, None)
+        task = self._pending.pop(cam_id, None)
+        if task is not None:
+            task.cancel()
+
+    def stats(self) -> dict:
+        ''' per camera counts of captured frames, skipped and failed ticks '''
+        return {cam_id: dict(counts) for cam_id, counts in self._stats.items()}
+
+    def next_tick(self, now=None) -> float:
+        ''' the first tick after `now` '''
+        now = time.time() if now is None else now
+        return (now // self._interval + 1) * self._interval
+
+    async def run(self):
+        ''' captures at every tick until cancelled or closed '''
+        self._runner = asyncio.current_task()
+        tick = self.next_tick()
+        while True:
+            delay = tick - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # ticks passed entirely, e.g. while the event loop was blocked or the host suspended
+            late = self.next_tick() - self._interval
+            while tick < late:
+                for cam_id in list(self._cams):
+                    self._write(cam_id, tick, time.time(), SKIPPED)
+                tick += self._interval
+            for cam_id, cam in list(self._cams.items()):
+                task = self._pending.get(cam_id)
+                if task is not None and not task.done():
+                    _LOGGER.debug('timelapse %s: still busy, skipping tick %d', cam_id, tick)
+                    self._write(cam_id, tick, time.time(), SKIPPED)
+                else:
+                    self._pending[cam_id] = asyncio.ensure_future(self._capture(cam_id, cam, tick))
+            tick += self._interval
+
+    async def _capture(self, cam_id, cam, tick):
+        try:
+            code, jpeg = await asyncio.wait_for(cam.async_snap_picture(self._profile), self._timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _LOGGER.warning('timelapse %s: %s', cam_id, e or type(e).__name__)
+            self._write(cam_id, tick, time.time(), FAILED)
+            return
+        if code != RESULT_CODE['0'] or not isinstance(jpeg, (bytes, bytearray)) or not jpeg:
+            _LOGGER.warning('timelapse %s: %s', cam_id, code)
+            self._write(cam_id, tick, time.time(), FAILED)
+        else:
+            self._write(cam_id, tick, time.time(), FRAME, jpeg)
+
+    def _write(self, cam_id, tick, stamp, status, frame=None):
+        ''' counts the tick's status and queues its record '''
+        counts = self._stats.get(cam_id)
+        if counts is not None:
+            counts[{FRAME: 'frames', SKIPPED: 'skipped', FAILED: 'failed'}[status]] += 1
+        self._writer.put((cam_id, tick, stamp, status, frame))
+
+    async def close(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        tasks = list(self._pending.values())
+        self._pending = {}
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._writer.close()
+
+    #
+    # ------------------
+    # Writer thread
+    #
+    def _write_record(self, archives, item):
+        cam_id, tick, stamp, status, frame = item
+        start = day_start(tick)
+        archive = archives.get(cam_id)
+        if archive is None or archive.start != start:
+            if archive is not None:
+                del archives[cam_id]
+                archive.close()
+            archive = archives[cam_id] = self._open_archive(cam_id, tick)
+        archive.put(tick, stamp, status, frame)
+
+    def _open_archive(self, cam_id, tick):
+        path = archive_path(self._directory, cam_id, tick, self._interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _DayArchive(path, day_start(tick), self._interval)
+
+
+#
+# ------------------
+# Reader
+#
+class TimelapseReader():
+    """ constant-time access to the tick records of one camera's timelapse """
+
+    def __init__(self, directory, cam_id, interval=INTERVAL):
+        self._directory = directory
+        self._cam_id = cam_id
+        self._interval = interval
+        self._files = {}    # day start -> (data file, index file)
+
+    def _open(self, start):
+        ''' the day's (data file, index file), or None while the day has no archive '''
+        files = self._files.get(start)
+        if files is None:
+            # a missing archive is not cached: the writer may create it any time
+            path = archive_path(self._directory, self._cam_id, start, self._interval)
+            try:
+                data = open(path + DATA_EXT, 'rb')
+            except FileNotFoundError:
+                return None
+            try:
+                index = open(path + INDEX_EXT, 'rb')
+            except FileNotFoundError:
+                data.close()
+                return None
+            except OSError:
+                data.close()
+                raise
+            header = index.read(HEADER.size)
+            if len(header) < HEADER.size:     # just created, header not flushed yet
+                data.close()
+                index.close()
+                return None
+            magic, _, interval = HEADER.unpack(header)
+            if magic != MAGIC or interval != self._interval:
+                data.close()
+                index.close()
+                raise ValueError('%s is not a %gs timelapse index' % (path + INDEX_EXT, self._interval))
+            files = self._files[start] = (data, index)
+        return files
+
+    def record(self, stamp):
+        '''
+        returns (tick, status, capture time, offset, length) of the tick covering
+        `stamp`; status is MISSING if nothing was recorded for it.
+        '''
+        tick = stamp - stamp % self._interval
+        start = day_start(tick)
+        files = self._open(start)
+        if files is not None:
+            slot = int((tick - start) // self._interval)
+            raw = os.pread(files[1].fileno(), TICK_RECORD.size, HEADER.size + slot * TICK_RECORD.size)
+            if len(raw) == TICK_RECORD.size:
+                stamp, offset, length, status = TICK_RECORD.unpack(raw)
+                return (tick, status, stamp, offset, length)
+        return (tick, MISSING, None, 0, 0)
+
+    def frame(self, stamp):
+        '''
+        returns (tick, status, JPEG bytes) of the tick covering `stamp`;
+        the JPEG is None unless the status is FRAME.
+        '''
+        tick, status, _, offset, length = self.record(stamp)
+        if status != FRAME:
+            return (tick, status, None)
+        data = os.pread(self._files[day_start(tick)][0].fileno(), length, offset)
+        if len(data) != length:     # frame bytes not flushed yet
+            return (tick, MISSING, None)
+        return (tick, status, data)
+
+    def frames(self, start, end):
+        ''' yields (tick, status, JPEG bytes) for the ticks from `start` to before `end` '''
+        tick = start - start % self._interval
+        while tick < end:
+            yield self.frame(tick)
+            tick += self._interval
+
+    def close(self):
+        for files in self._files.values():
+            if files is not None:
+                files[0].close()
+                files[1].close()
+        self._files = {}
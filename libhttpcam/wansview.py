@@ -1,11 +1,16 @@
+import asyncio
 import time
 import math
 import re
-from libhttpcam.httpcam import HttpCam, cmdConcat, Response, Action, Trigger, Status, IRmode
-from libhttpcam.httpcam import NTP_SERVER, RESULT_CODE
+from libhttpcam.httpcam import HttpCam, cmdConcat, Response, Action, Trigger, Status, IRmode, Profile
+from libhttpcam.httpcam import NTP_SERVER, RESULT_CODE, HttpCamError
 import logging
 import requests
 from .AuthDigest import DigestAuth
+from .mjpeg import SOI
+from .bufferpool import PooledBuffer
+from .scheduler import Priority
+from .results import WansviewAlarmTrigger, WansviewAlarmAction, WansviewInfrared
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,18 +22,44 @@ ALERT_LENGTH = 5        # seconds of audio alert (5 or more)
 
 JOINT_TRIGGER = 'off'   # 'on' | 'off' = independent trigger
 
+# direct JPEG endpoints offered by some firmware versions, probed in order;
+# channel 1 is the lower resolution sub stream
+SNAP_PATHS = {
+    Profile.FULL: [
+        'tmpfs/snap.jpg',
+        'tmpfs/auto.jpg',
+        'mjpeg/snap.cgi?chn=0',
+    ],
+    Profile.PREVIEW: [
+        'mjpeg/snap.cgi?chn=1',
+    ],
+}
+NO_SNAP_PATH = ''       # probed: no direct endpoint, use manualsnap
+SNAP_FAILURES = 3       # consecutive failed direct snapshots before switching to manualsnap
+REPROBE_SECONDS = 600   # seconds after which a camera using manualsnap is probed again
+
 
 class Wansview(HttpCam):
     """ http-based communication routines for WANSVIEW cameras. """
 
-    def __init__(self, url, port=None):
+    def __init__(self, url, port=None, session=None):
         if port is None:
             port = 80
-        super(Wansview, self).__init__('Wansview', url, port)
+        super(Wansview, self).__init__('Wansview', url, port, session)
+        self._snap_path = {}        # Profile -> direct snapshot path; missing: not probed yet
+        self._snap_probed = {}      # Profile -> monotonic time of the last probe
+        self._snap_failures = {}    # Profile -> consecutive failed direct snapshots
 
     def _getQueryPath(self, cmd, paramStr):
         return '%s/%s?%s' % (CMD_PATH, cmd, paramStr)
 
+    def _requestPriority(self, cmd, params):
+        groups = [params] if params and isinstance(params[0], tuple) else (params or [])
+        subcmds = [dict(g).get('cmd', '') for g in groups]
+        if 'manualsnap' in subcmds:
+            return Priority.STREAM
+        return Priority.READ if all(c.startswith('get') for c in subcmds) else Priority.WRITE
+
     def _parseResult(self, result, params):
         # p = re.compile(r'(((?:var .*;\n)+)|.+\s*)')
         p = re.compile(r'(((?:var .*.\n?)+)|.+\s*)')
@@ -59,18 +90,11 @@ class Wansview(HttpCam):
             _LOGGER.debug("_parseResult '%s': '%s", pr[0], pr[1])
         return pr
 
-    async def _async_get(self, url, raw):
+    async def _async_request(self, url):
         '''
-        asyncronously sends a GET command with Digest authentication for the supplied URL and
-        if raw == True, returns the raw result, else returns a a text result
+        asyncronously sends a GET request with Digest authentication for the supplied URL
         '''
-        if self._session is None:
-            _LOGGER.warn('_async_get: session not defined')
-        else:
-            # _LOGGER.debug('async get %s', url)
-            response = await self._auth.request('GET', url)
-            result = await response.read() if raw else await response.text()
-            return result
+        return await self._auth.request('GET', url)
 
     #
     # ------------------
@@ -215,6 +239,20 @@ class Wansview(HttpCam):
     # ------------------
     # Device queries
     #
+    async def _async_query(self, cgi, cmds, result_cls, required):
+        '''
+        fetches the commands and decodes the reply as `result_cls`.
+        Raises HttpCamError if the query failed or the reply lacks a `required` key,
+        rather than decoding the missing values as off.
+        '''
+        code, result = await self._async_fetch(cgi, cmds)
+        if code != RESULT_CODE['0'] or not isinstance(result, dict):
+            raise HttpCamError('%s failed: %s' % (cgi, code), self)
+        missing = [key for key in required if key not in result]
+        if missing:
+            raise HttpCamError('%s reply lacks %s' % (cgi, ', '.join(missing)), self)
+        return result_cls.from_dict(result)
+
     async def async_get_night_mode(self) -> IRmode:
         ''' 
         gets the camera's night mode setting.
@@ -222,14 +260,14 @@ class Wansview(HttpCam):
         - bool IR-LED Status
         - bool IR Sensor Status
         '''
-        result = await self._async_fetch('irctrl.cgi', [
+        ir = await self._async_query('irctrl.cgi', [
             [('cmd', 'getinfrared')],       # 'infraredstatus': 'close'
             [('cmd', 'getirparams')],       # 'irparams': '20' - brighness
             [('cmd', 'getircutctrl')],      # 'ircutctrlstatus': 'manual'
             [('cmd', 'getircuttime')],      # 'starttime': '19:00:00', 'endtime': '07:00:00'
             [('cmd', 'getircutstatus')]     # 'ircutstatus: 'close'
-        ])
-        return IRmode(LED=result[1]['infraredstatus'], Sensor=result[1]['ircutstatus'])
+        ], WansviewInfrared, ('infraredstatus', 'ircutstatus'))
+        return IRmode(LED=ir.infraredstatus, Sensor=ir.ircutstatus)
 
     async def async_get_alarm_trigger(self) -> Trigger:
         '''
@@ -245,14 +283,11 @@ class Wansview(HttpCam):
             'sensitivity_3': "'50'", 'name_3': "'MD3'",
             'aa_enable': '1', 'aa_value': '0'})
         '''
-        result = await self._async_fetch('alarm.cgi', [
+        config = await self._async_query('alarm.cgi', [
             [('cmd', 'getmdattr'), ('cmd', 'getaudioalarmattr')]
-        ])
-        # _LOGGER.warn('async_get_alarm_trigger %s\n%s', self._host, result)
-        return Trigger(
-            motion=True if result[1]['enable_0'] == '1' else False,
-            audio=True if result[1]['aa_enable'] == '1' else False
-        )
+        ], WansviewAlarmTrigger, ('enable_0', 'aa_enable'))
+        # _LOGGER.warn('async_get_alarm_trigger %s\n%s', self._host, config)
+        return config.trigger
 
     async def async_get_alarm_action(self) -> Action:
         """
@@ -264,7 +299,7 @@ class Wansview(HttpCam):
             'alarmpresetindex': '1', 'act_alarmbeep_switch': 'off', 'audiotime': '5'
         })
         """
-        result = await self._async_fetch('alarm.cgi', [
+        config = await self._async_query('alarm.cgi', [
             [('cmd', 'getalarmact'), ('aname', 'ftpsnap')],
             [('cmd', 'getalarmact'), ('aname', 'ftprec')],
             [('cmd', 'getalarmact'), ('aname', 'type')],
@@ -277,17 +312,9 @@ class Wansview(HttpCam):
             [('cmd', 'getmotorattr')],
             [('cmd', 'getalarmact'), ('aname', 'alarmbeep')],
             [('cmd', 'getalarmbeepattr')]
-        ])
-        # _LOGGER.warn('async_get_alarm_action %s\n%s', self._host, result)
-        return Action(
-            audio=True if result[1]['act_alarmbeep_switch'] == 'on' else False,
-            ftp_snap=True if result[1]['act_ftpsnap_switch'] == 'on' else False,
-            ftp_rec=True if result[1]['act_ftprec_switch'] == 'on' else False
-        )
-
-    async def async_get_alarm_triggered(self) -> bool:
-        ''' returns True if the camera has detected an alarm. '''
-        return False
+        ], WansviewAlarmAction, ('act_ftpsnap_switch', 'act_ftprec_switch', 'act_alarmbeep_switch'))
+        # _LOGGER.warn('async_get_alarm_action %s\n%s', self._host, config)
+        return config.action
 
     async def async_get_ftp_config(self) -> Response:
         ''' gets the camera's ftp configuration '''
@@ -299,8 +326,60 @@ class Wansview(HttpCam):
     # ------------------
     # Device actions
     #
-    async def async_snap_picture(self):
-        ''' Manually request snapshot. Returns raw JPEG data. '''
+    async def _async_detect_profile(self, profile: Profile) -> dict:
+        ''' the preview profile uses the sub stream channel's snapshot endpoint, if the firmware has one '''
+        if profile != Profile.PREVIEW:
+            return await super(Wansview, self)._async_detect_profile(profile)
+        if profile not in self._snap_path:
+            _release(await self._async_detect_snap_path(profile))
+        return {'snapshot': self._snap_path[profile] != NO_SNAP_PATH, 'stream': False, 'sub_stream': False}
+
+    async def _async_snap_picture(self, profile=Profile.FULL, pool=None):
+        '''
+        Request a snapshot. Returns raw JPEG data.
+        Uses a direct JPEG endpoint (one request) if the firmware has one,
+        otherwise `manualsnap` followed by a GET of the stored picture.
+        '''
+        path = self._snap_path.get(profile)
+        if path is None or (path == NO_SNAP_PATH and
+                            time.monotonic() - self._snap_probed[profile] >= REPROBE_SECONDS):
+            img = await self._async_detect_snap_path(profile, pool)
+            if img is not None:
+                return (RESULT_CODE['0'], img)
+            path = self._snap_path[profile]
+        if path != NO_SNAP_PATH:
+            img = await self._async_direct_snap(path, pool)
+            if img is not None:
+                self._snap_failures[profile] = 0
+                return (RESULT_CODE['0'], img)
+            # a busy or error reply: use manualsnap for this snapshot, and for the
+            # next REPROBE_SECONDS once the endpoint failed SNAP_FAILURES times in a row
+            failures = self._snap_failures.get(profile, 0) + 1
+            if failures >= SNAP_FAILURES:
+                _LOGGER.warn('%s: direct snapshot %s failed %d times, falling back to manualsnap',
+                             self._host, path, failures)
+                self._snap_path[profile] = NO_SNAP_PATH
+                self._snap_probed[profile] = time.monotonic()
+                failures = 0
+            self._snap_failures[profile] = failures
+        return await self._async_manual_snap(pool)
+
+    async def _async_direct_snap(self, path, pool=None):
+        ''' GETs a direct snapshot endpoint; returns the JPEG, or None if the reply is not a JPEG or failed '''
+        try:
+            async with self._scheduler.slot(Priority.STREAM):
+                img = await self._async_get('http://%s:%s/%s' % (self._host, self._port, path), raw=True, pool=pool)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _LOGGER.debug('%s: direct snapshot %s failed: %s', self._host, path, e)
+            return None
+        if img and img[:2] == SOI:
+            return img
+        _release(img)
+        return None
+
+    async def _async_manual_snap(self, pool=None):
         code, path = await self._async_fetch('av.cgi', [
             [('cmd', 'manualsnap'), ('chn', 0)]
         ])
@@ -308,10 +387,29 @@ class Wansview(HttpCam):
             _LOGGER.warn('%s: received unexpected "%s" getting snap path', self._host, code)
         if isinstance(path, dict):
             imgurl = 'http://%s:%s%s' % (self._host, self._port, path['picpath'])
-            return (RESULT_CODE['0'], await self._async_get(imgurl, raw=True))
+            async with self._scheduler.slot(Priority.STREAM):
+                return (RESULT_CODE['0'], await self._async_get(imgurl, raw=True, pool=pool))
         else:
             return (RESULT_CODE['-3'], '')
 
+    async def _async_detect_snap_path(self, profile=Profile.FULL, pool=None):
+        '''
+        sets the camera's direct snapshot path for the profile, or NO_SNAP_PATH, by probing SNAP_PATHS.
+        Returns the image received while probing, if any.
+        '''
+        self._snap_path[profile] = NO_SNAP_PATH
+        self._snap_probed[profile] = time.monotonic()
+        self._snap_failures[profile] = 0
+        found = None
+        for path in SNAP_PATHS[profile]:
+            found = await self._async_direct_snap(path, pool)
+            if found is not None:
+                self._snap_path[profile] = path
+                break
+        _LOGGER.info('%s: using %s snapshot path "%s"', self._host, profile.value,
+                     self._snap_path[profile] or 'manualsnap')
+        return found
+
     async def async_set_alarm(self, trigger: Trigger, action: Action) -> Response:
         ''' Get the current config and set the motion detection on or off '''
         md = 1 if trigger.motion else 0
@@ -338,28 +436,36 @@ class Wansview(HttpCam):
             [('cmd', 'setalarmbeepattr'), ('audiotime', ALERT_LENGTH)]
         ])
 
-    async def async_ptz_preset(self, preset_pos:int) -> Response:
+    async def _async_ptz_configure(self) -> Response:
+        ''' motor speed, tour and realtime position settings, applied once before the first preset move '''
+        return await self._async_fetch('ptz.cgi', [
+            [('cmd',  'setmotorattr'),
+                ('tiltscan',     1),
+                ('panscan',      1),
+                ('tiltspeed',    3),    # 1 low, 2: med, 3: fast
+                ('panspeed',     3),
+                ('movehome',     'on'),
+                ('ptzalarmmask', 'on'),
+                ('selfdet',      'on'),
+                ('homegopos',    1)],
+            [('cmd',  'setptztour'),
+                ('tour_enable',   0),
+                ('tour_index',    ''),
+                ('tour_interval', '')],
+            [('cmd',  'setrealtimeptzpos'),
+                ('realTimeposenable',  0)]
+        ])
+
+    async def _async_ptz_goto(self, preset_pos) -> Response:
         ''' set to predefined PTZ position '''
-        if preset_pos is not None:
-            return await self._async_fetch('ptz.cgi', [
-                [('cmd',  'setmotorattr'),
-                    ('tiltscan',     1),
-                    ('panscan',      1),
-                    ('tiltspeed',    3),    # 1 low, 2: med, 3: fast
-                    ('panspeed',     3),
-                    ('movehome',     'on'),
-                    ('ptzalarmmask', 'on'),
-                    ('selfdet',      'on'),
-                    ('homegopos',    1)],
-                [('cmd',  'setptztour'),
-                    ('tour_enable',   0),
-                    ('tour_index',    ''),
-                    ('tour_interval', '')],
-                [('cmd',  'setrealtimeptzpos'),
-                    ('realTimeposenable',  0)],
-                [('cmd',      'preset'),
-                    ('act',      'goto'),
-                    ('number',   preset_pos)]
-            ])
-        else:
-            return (RESULT_CODE['0'], '')
+        return await self._async_fetch('ptz.cgi', [
+            [('cmd',      'preset'),
+                ('act',      'goto'),
+                ('number',   preset_pos)]
+        ])
+
+
+def _release(body):
+    ''' returns a discarded pooled body to its pool '''
+    if isinstance(body, PooledBuffer):
+        body.release()
@@ -14,6 +14,9 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/HelpfulScripts/libhttpcam",
     packages=setuptools.find_packages(),
+    extras_require={
+        'archive': ['numpy', 'Pillow'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",